@@ -0,0 +1,65 @@
+"""
+Compares memory use and name lookup latency of the mod catalog against the list of dicts it replaced.
+
+Usage: python benchmarks/catalog.py [number of mods]
+"""
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog import ModCatalog
+
+VERSIONS = ["0.13", "0.14", "0.15", "0.16", "0.17", "0.18", "1.0", "1.1"]
+LOOKUPS = 200
+
+def make_rows(count: int):
+    """
+    Yields (name, title, owner, factorio_version) rows. Every string is a new object, like rows read from sqlite.
+    """
+    rng = random.Random(0)
+    for i in range(count):
+        yield (f"mod-{i:06d}", f"Some Mod Title Number {i}", f"modder{rng.randrange(count // 8 + 1)}",
+               rng.choice(VERSIONS).encode().decode())
+
+def measure(build) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    names = [f"mod-{i:06d}" for i in random.Random(1).sample(range(count), LOOKUPS)] + ["missing-mod"]
+
+    listcache, list_size, list_build = measure(lambda: [{"name": name, "title": title, "owner": owner, "factorio_version": factorio_version}
+                                                        for name, title, owner, factorio_version in make_rows(count)])
+    catalog, catalog_size, catalog_build = measure(lambda: _build_catalog(make_rows(count)))
+
+    start = time.perf_counter()
+    for name in names:
+        assert (name in [mod["name"] for mod in listcache]) == (name != "missing-mod")
+    list_lookup = (time.perf_counter() - start) / len(names)
+
+    start = time.perf_counter()
+    for name in names:
+        assert (name in catalog) == (name != "missing-mod")
+    catalog_lookup = (time.perf_counter() - start) / len(names)
+
+    print(f"{count} mods")
+    print(f"{'layout':<15}{'memory':>12}{'build':>12}{'lookup':>14}")
+    print(f"{'list of dicts':<15}{list_size / 2**20:>9.1f} MB{list_build * 1000:>9.1f} ms{list_lookup * 1e6:>11.1f} us")
+    print(f"{'ModCatalog':<15}{catalog_size / 2**20:>9.1f} MB{catalog_build * 1000:>9.1f} ms{catalog_lookup * 1e6:>11.1f} us")
+
+def _build_catalog(rows) -> ModCatalog:
+    catalog = ModCatalog()
+    catalog.sync(rows)
+    return catalog
+
+if __name__ == "__main__":
+    main()
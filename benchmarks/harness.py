@@ -0,0 +1,325 @@
+"""
+Offline benchmark of the update pipeline and the autocomplete handlers.
+
+Serves a generated mod catalog from a local stand-in for the mod portal, runs one update check through the ModUpdates
+cog against a temporary database, drains the outbox into fake Discord channels, and times the autocomplete handlers of
+the command cog. Reports tick latency, delivery throughput, autocomplete p50/p99 and peak memory.
+
+Usage: python benchmarks/harness.py [--mods N] [--updates N] [--guilds N] [--catchup] [--json] ...
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import resource
+import tempfile
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VERSIONS = ["0.17", "0.18", "1.0", "1.1", "1.1", "1.1"]
+WORDS = ["advanced", "belt", "train", "logistics", "power", "armor", "rail", "factory", "robot", "circuit", "fluid",
+         "mining", "inserter", "solar", "nuclear", "module", "tweaks", "overhaul", "signal", "storage", "combinator"]
+
+def timestamp(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def generate_catalog(count: int, updates: int, catchup: bool) -> tuple:
+    """
+    Generates the stored catalog and the portal's view of it, in which `updates` random mods have a newer release.
+
+    Returns the stored rows in mods table format, and the portal results sorted by update and by creation.
+    """
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    offset = timedelta(minutes=20 if catchup else 5)
+    owners = [f"modder_{i}" for i in range(max(1, count // 8))]
+    stored = []
+    for i in range(count):
+        title = " ".join(rng.sample(WORDS, 3)).title() + f" {i}"
+        released = timestamp(now - offset - timedelta(seconds=count - i))
+        stored.append([f"mod-{i:06d}", released, title, rng.choice(owners), "1.0.0", rng.choice(VERSIONS)])
+
+    updated = rng.sample(range(count), min(updates, count))
+    portal = {mod[0]: list(mod) for mod in stored}
+    for j, i in enumerate(updated):
+        mod = portal[stored[i][0]]
+        mod[1] = timestamp(now - timedelta(milliseconds=10 * j))
+        mod[4] = "1.0.1"
+
+    def result(mod):
+        name, released, title, owner, version, factorio_version = mod
+        return {"name": name, "title": title, "owner": owner,
+                "latest_release": {"released_at": released, "version": version, "info_json": {"factorio_version": factorio_version}}}
+    by_created = [result(portal[mod[0]]) for mod in stored]
+    by_updated = sorted(by_created, key=lambda mod: mod["latest_release"]["released_at"], reverse=True)
+    return stored, by_updated, by_created
+
+
+class PortalStandIn:
+    '''
+    Local aiohttp server answering /api/mods (paginated, sorted by update or creation) and /api/mods/{name}.
+    Runs on its own thread and event loop so serving does not compete with the code being measured.
+    '''
+    def __init__(self, by_updated: list, by_created: list, latency: float) -> None:
+        self.listings = {"updated_at": by_updated, "created_at": by_created}
+        self.mods = {mod["name"]: mod for mod in by_created}
+        self.latency = latency
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    def start(self) -> str:
+        started = threading.Event()
+        threading.Thread(target=self.run, args=(started,), daemon=True).start()
+        started.wait()
+        return f"http://127.0.0.1:{self.port}"
+
+    def run(self, started: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get("/api/mods", self.list_mods)
+        app.router.add_get("/api/mods/{name}", self.get_mod)
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = runner.addresses[0][1]
+        started.set()
+        self.loop.run_forever()
+
+    async def list_mods(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        page_size = int(request.query.get("page_size", 25))
+        page = int(request.query.get("page", 1))
+        listing = self.listings[request.query.get("sort", "created_at")]
+        if request.query.get("sort_order") == "asc" and request.query.get("sort") == "updated_at":
+            listing = listing[::-1]
+        results = listing[(page - 1) * page_size:page * page_size]
+        return web.json_response({"pagination": {"count": len(listing), "page": page, "page_size": page_size}, "results": results})
+
+    async def get_mod(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        mod = self.mods.get(request.match_info["name"])
+        if mod is None:
+            return web.json_response({"message": "Mod not found"}, status=404)
+        return web.json_response({"name": mod["name"], "title": mod["title"], "owner": mod["owner"], "summary": "Generated mod",
+                                  "downloads_count": 1000, "thumbnail": f"/assets/{mod['name']}.thumb.png"})
+
+
+class ChannelSink:
+    '''
+    Records messages sent to fake channels. Every send takes `latency` seconds, and a fraction is rate limited: like
+    discord.py does internally for 429 responses, those wait `retry_after` seconds and are then sent again.
+    '''
+    def __init__(self, latency: float, rate_limited: float, retry_after: float) -> None:
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.rng = random.Random(1)
+        self.messages = 0
+        self.embeds = 0
+        self.ratelimits = 0
+
+    async def send(self, channel_id: int, embeds: list) -> None:
+        await asyncio.sleep(self.latency)
+        while self.rng.random() < self.rate_limited:
+            self.ratelimits += 1
+            await asyncio.sleep(self.retry_after + self.latency)
+        self.messages += 1
+        self.embeds += len(embeds)
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, sink: ChannelSink) -> None:
+        self.id = channel_id
+        self.sink = sink
+
+    async def send(self, content=None, *, embed=None, embeds=None, **kwargs):
+        await self.sink.send(self.id, embeds if embeds is not None else [embed])
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+def make_queries(stored: list, count: int) -> list:
+    """
+    Generates autocomplete input: short prefixes, title words, partial names and misspelled words.
+    """
+    rng = random.Random(2)
+    queries = []
+    for i in range(count):
+        name, released, title, owner, version, factorio_version = rng.choice(stored)
+        kind = i % 4
+        if kind == 0:
+            queries.append(title[0:rng.randint(1, 2)])
+        elif kind == 1:
+            queries.append(rng.choice(title.split())[0:rng.randint(3, 8)])
+        elif kind == 2:
+            queries.append(name[0:rng.randint(4, len(name))])
+        else:
+            word = list(rng.choice(WORDS))
+            position = rng.randrange(len(word) - 1)
+            word[position], word[position + 1] = word[position + 1], word[position]
+            queries.append("".join(word))
+    return queries
+
+async def run(args: argparse.Namespace, stored: list, portal: PortalStandIn) -> dict:
+    from database import Database
+    from schema import make_tables
+    from portal import PortalClient
+    from catalog import ModCatalog
+    from changefeed import ModChangeFeed
+    from subscriptions import SubscriptionIndex
+    from guildsettings import GuildSettingsCache
+    from cogs.modupdates import ModUpdates
+    from cogs.commands import CommandCog
+
+    sink = ChannelSink(args.send_latency, args.rate_limited, args.retry_after)
+
+    bot = SimpleNamespace()
+    bot.db = Database(os.path.join(os.getcwd(), "mods.db"))
+    bot.portal = PortalClient()
+    bot.subscriptions = SubscriptionIndex()
+    bot.mod_feed = ModChangeFeed()
+    bot.catalog = ModCatalog()
+    bot.mod_feed.subscribe(bot.catalog.apply_mod_changes)
+    bot.catalog_ready = asyncio.Event() #Never set, so the cogs' own loops stay idle
+    bot.guild_settings = GuildSettingsCache(bot.db)
+    bot.is_poller = True
+    bot.shard_count = None
+    bot.shard_ids = None
+    channels = {}
+    bot.get_channel = channels.get
+
+    async def wait_until_ready():
+        pass
+    bot.wait_until_ready = wait_until_ready
+
+    await bot.portal.start()
+    await bot.db.connect()
+    rng = random.Random(3)
+    guilds = []
+    subscriptions = []
+    for i in range(args.guilds):
+        guild_id, channel_id = 10**6 + i, 10**7 + i
+        channels[channel_id] = FakeChannel(channel_id, sink)
+        guilds.append((str(channel_id), str(guild_id)))
+        if rng.random() < args.subscribed:
+            subscriptions += [(str(guild_id), stored[j][0]) for j in rng.sample(range(len(stored)), min(args.subscriptions, len(stored)))]
+
+    def setup(cur):
+        #Same schema the bot creates on a first start, then filled as if the catalog bootstrap had completed
+        make_tables(cur, {guild_id for channel_id, guild_id in guilds})
+        cur.executemany("UPDATE guilds SET updates_channel = (?) WHERE id = (?)", guilds)
+        cur.executemany("INSERT INTO subscriptions VALUES (?, ?)", subscriptions)
+        cur.executemany("INSERT INTO mods VALUES (?, ?, ?, ?, ?, ?)", stored)
+        cur.execute("DELETE FROM bootstrap")
+        bot.subscriptions.build(cur)
+    await bot.db.run(setup)
+    bot.catalog.sync(await bot.db.get_mods())
+
+    updates = ModUpdates(bot)
+    commands = CommandCog(bot)
+    commands.update_mods_cache.cancel()
+    commands.search_index.sync(bot.catalog.rows())
+    results = {"mods": args.mods, "updates": args.updates, "guilds": args.guilds}
+
+    try:
+        #Update check, timed like a tick of check_mod_updates
+        start = time.perf_counter()
+        updatelist = await updates.check_updates()
+        await bot.db.outbox_depth()
+        results["tick_latency"] = time.perf_counter() - start
+        results["updates_found"] = len(updatelist)
+        results["queued"] = await bot.db.outbox_depth()
+        results["portal_requests"] = portal.requests
+
+        #Outbox delivery
+        start = time.perf_counter()
+        await updates.cog_load()
+        while await bot.db.outbox_depth() > 0:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        results["delivery_time"] = elapsed
+        results["messages"] = sink.messages
+        results["notifications"] = sink.embeds
+        results["ratelimits"] = sink.ratelimits
+        results["messages_per_second"] = sink.messages / elapsed
+        results["notifications_per_second"] = sink.embeds / elapsed
+
+        #Autocomplete
+        interaction = SimpleNamespace(namespace=SimpleNamespace(version=None), guild_id=10**6)
+        for label, handler in [("find_mod", commands.find_autocomplete), ("add_subscription", commands.modname_autocomplete)]:
+            latencies = []
+            for query in make_queries(stored, args.queries):
+                start = time.perf_counter()
+                await handler(interaction, query)
+                latencies.append(time.perf_counter() - start)
+            results[f"{label}_autocomplete_p50"] = percentile(latencies, 0.5)
+            results[f"{label}_autocomplete_p99"] = percentile(latencies, 0.99)
+    finally:
+        updates.cog_unload()
+        commands.cog_unload()
+        await bot.portal.close()
+        await bot.db.close()
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return results
+
+def report(results: dict) -> None:
+    lines = [("Tick latency", f"{results['tick_latency'] * 1000:.1f} ms ({results['updates_found']} updates found, "
+                              f"{results['queued']} notifications queued, {results['portal_requests']} portal requests)"),
+             ("Delivery", f"{results['messages']} messages ({results['notifications']} notifications) in "
+                          f"{results['delivery_time']:.2f} s, {results['ratelimits']} rate limited"),
+             ("Throughput", f"{results['messages_per_second']:.1f} messages/s, {results['notifications_per_second']:.1f} notifications/s")]
+    for label in ["find_mod", "add_subscription"]:
+        lines.append((f"{label} autocomplete", f"p50 {results[f'{label}_autocomplete_p50'] * 1000:.2f} ms, "
+                                               f"p99 {results[f'{label}_autocomplete_p99'] * 1000:.2f} ms"))
+    lines.append(("Peak memory", f"{results['peak_rss_mb']:.0f} MB RSS"))
+    print(f"{results['mods']} mods, {results['updates']} updates, {results['guilds']} guilds")
+    for label, value in lines:
+        print(f"{label + ':':<31}{value}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mods", type=int, default=20000, help="number of mods in the catalog")
+    parser.add_argument("--updates", type=int, default=50, help="number of mods updated since the last check")
+    parser.add_argument("--guilds", type=int, default=200, help="number of guilds with an updates channel")
+    parser.add_argument("--subscribed", type=float, default=0.5, help="fraction of guilds with subscriptions")
+    parser.add_argument("--subscriptions", type=int, default=20, help="number of subscriptions per subscribed guild")
+    parser.add_argument("--catchup", action="store_true", help="make the last check old enough to trigger catch-up mode")
+    parser.add_argument("--portal-latency", type=float, default=0.05, help="seconds per portal request")
+    parser.add_argument("--send-latency", type=float, default=0.1, help="seconds per message send")
+    parser.add_argument("--rate-limited", type=float, default=0.02, help="fraction of sends answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="seconds to wait after a 429")
+    parser.add_argument("--queries", type=int, default=500, help="number of autocomplete queries per handler")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log output")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+
+    stored, by_updated, by_created = generate_catalog(args.mods, args.updates, args.catchup)
+    portal = PortalStandIn(by_updated, by_created, args.portal_latency)
+    os.environ["PORTAL_URL"] = portal.start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = asyncio.run(run(args, stored, portal))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+if __name__ == "__main__":
+    main()
@@ -8,24 +8,35 @@ from dotenv import load_dotenv
 import sqlite3
 import logging
 import traceback
+import asyncio
+import time
+import socket
 
+load_dotenv() #Before the imports below, which read their settings from the environment
 from migrations import migrate
-from misc import get_mods
+from schema import make_tables, next_catalog_page
+from portal import PortalClient, PORTAL_URL
+from subscriptions import SubscriptionIndex
+from changefeed import ModChangeFeed
+from database import Database
+from guildsettings import GuildSettingsCache
+from catalog import ModCatalog
+from metrics import MetricsServer, metrics
+from logconfig import setup_logging
 
 SHARED_VOLUME = "."
 DB_NAME = f"{SHARED_VOLUME}/mods.db"
+BOOTSTRAP_PAGE_SIZE = 500
+POLLER_LEASE_TTL = 60
+POLLER_LEASE_RENEW = 20
+FOLLOW_INTERVAL = 60
 
-if os.path.isfile(f"{SHARED_VOLUME}/botlog.old.log"):
-    os.remove(f"{SHARED_VOLUME}/botlog.old.log")
-
-if os.path.isfile(f"{SHARED_VOLUME}/botlog.log"):
-    os.rename(f"{SHARED_VOLUME}/botlog.log", f"{SHARED_VOLUME}/botlog.old.log")
-
-logging.basicConfig(filename=f"{SHARED_VOLUME}/botlog.log", filemode = "w", format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+setup_logging()
+logger = logging.getLogger("bot")
 
 
 # Version updates
-current_version = 1
+current_version = 3
 with sqlite3.connect(DB_NAME) as con:
     cur = con.cursor()
     last_version = int(cur.execute("SELECT current_version FROM version").fetchone()[0])
@@ -35,36 +46,131 @@ if not last_version == current_version:
     migrate(last_version, current_version)
 
 extensions = []
-logging.debug("Loading cogs")
+logger.debug("Loading cogs")
 for root, _, files in os.walk("cogs"):
     for file in files:
         path = os.path.join(root, file)
         if path.endswith(".py"):
             extensions.append(path.split(".py")[0].replace(os.sep, "."))
-            logging.debug(f"Loaded cog: {path}")
+            logger.debug(f"Loaded cog: {path}")
 
 intents = discord.Intents.none()
 intents.guilds = True
 intents.integrations = True
 
-load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 PREFIX = os.getenv('PREFIX') + " "
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None #Total number of shards, default: Discord's recommendation
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS").split(",")] if os.getenv("SHARD_IDS") else None #Shards run by this process, default: all
 
-class MyBot(commands.Bot):
+class MyBot(commands.AutoShardedBot):
+    '''
+    The bot can be split over several processes sharing mods.db, each running some of the shards (SHARD_COUNT and
+    SHARD_IDS). One process at a time holds the poller lease and checks the mod portal. It queues updates in the
+    outbox, and every process delivers the entries of its own shards. Other processes follow the mods it stores to
+    keep their catalog up to date.
+    '''
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.subscriptions = SubscriptionIndex()
+        self.portal = PortalClient()
+        self.mod_feed = ModChangeFeed()
+        self.catalog = ModCatalog()
+        self.mod_feed.subscribe(self.catalog.apply_mod_changes)
+        self.db = Database(DB_NAME)
+        self.guild_settings = GuildSettingsCache(self.db)
+        self.catalog_ready = asyncio.Event()
+        self.metrics_server = MetricsServer(metrics)
+        self.bootstrap_task = None
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_poller = False
+        self.lease_task = None
+        self.follow_task = None
+        self.mods_rowid = 0
+        self.subscriptions_generation = None
     
     async def setup_hook(self) -> None:
-        logging.info("Bot starting up")
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            await self.make_or_update_tables(con, cur)
+        logger.info("Bot starting up")
+        await self.portal.start()
+        await self.metrics_server.start()
+        await self.db.connect()
+        next_page = await self.make_or_update_tables()
+        self.is_poller = await self.db.acquire_lease("poller", self.instance_id, POLLER_LEASE_TTL)
+        logger.info(f"Running shards {self.shard_ids or 'all'} of {self.shard_count or 'recommended'} as {self.instance_id}, poller: {self.is_poller}")
+        self.lease_task = asyncio.create_task(self.hold_poller_lease())
+        if next_page is None:
+            self.catalog_ready.set()
+        else:
+            #Mods table is new or was not completely filled - download the catalog in the background.
+            self.bootstrap_task = asyncio.create_task(self.bootstrap_catalog())
+        mods, self.mods_rowid = await self.db.get_mod_rows()
+        self.catalog.sync([(name, title, owner, factorio_version) for name, release_date, title, owner, version, factorio_version in mods])
+        self.follow_task = asyncio.create_task(self.follow_mod_changes())
+        await self.refresh_subscriptions()
         for extension in extensions:
             await bot.load_extension(extension)
 
+    async def close(self):
+        for task in [self.bootstrap_task, self.lease_task, self.follow_task]:
+            if task is not None:
+                task.cancel()
+        await self.portal.close()
+        await self.metrics_server.close()
+        await super().close()
+        if self.is_poller:
+            await self.db.release_lease("poller", self.instance_id)
+        await self.db.close()
+
+    async def hold_poller_lease(self):
+        """
+        Keeps renewing the poller lease, or tries to take it over once its holder stops renewing it.
+        """
+        while True:
+            await asyncio.sleep(POLLER_LEASE_RENEW)
+            try:
+                held = await self.db.acquire_lease("poller", self.instance_id, POLLER_LEASE_TTL)
+            except Exception as error:
+                logger.warning(f"{error} renewing poller lease")
+                held = False
+            if held != self.is_poller:
+                logger.info(f"{'Acquired' if held else 'Lost'} poller lease")
+            self.is_poller = held
+
+    async def follow_mod_changes(self):
+        """
+        Applies mods stored by the polling process to the catalog of this process.
+
+        Every stored row is published, also while this process is the poller and already published its own changes.
+        Applying a change twice is harmless, while skipping rows would lose those stored by the previous poller around
+        a lease takeover.
+        """
+        while True:
+            await asyncio.sleep(FOLLOW_INTERVAL)
+            try:
+                mods, self.mods_rowid = await self.db.get_mod_rows(self.mods_rowid)
+            except Exception as error:
+                logger.warning(f"{error} following mod changes")
+                continue
+            self.mod_feed.publish(mods)
+
+    async def refresh_subscriptions(self):
+        """
+        Rebuilds the subscription index if the guilds or subscriptions tables changed since it was built, possibly in
+        another process.
+        """
+        generation = await self.db.subscriptions_generation()
+        if generation == self.subscriptions_generation:
+            return
+        index = SubscriptionIndex()
+        self.subscriptions_generation = await self.db.run(self.build_subscriptions, index)
+        self.subscriptions = index
+
+    def build_subscriptions(self, cur, index: SubscriptionIndex) -> int:
+        index.build(cur)
+        return cur.execute("SELECT value FROM generations WHERE name = 'subscriptions'").fetchone()[0]
+
     async def on_ready(self):
-        logging.info("Bot ready")
+        logger.info("Bot ready")
         await bot.tree.sync(guild=discord.Object(763041705024552990))
         await bot.change_presence(status=discord.Status.online, activity=discord.Game("Factorio"))
         appinfo = await self.application_info()
@@ -72,69 +178,81 @@ class MyBot(commands.Bot):
         await self.owner.send("Mod update bot started!")
     
     async def on_disconnect(self):
-        logging.debug("Disconnected")
+        logger.debug("Disconnected")
     
     async def on_connect(self):
-        logging.debug("connected")
+        logger.debug("connected")
 
     async def on_guild_join(self, guild: discord.Guild):
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            cur.execute("INSERT OR IGNORE INTO guilds VALUES (?, ?, ?, ?)", (str(guild.id), None, None, None))
-            con.commit()
+        await self.db.add_guild(guild.id)
+        self.guild_settings.invalidate(guild.id)
         await self.owner.send(f"Joined guild: {guild.name}")
-        logging.info(f"Joined guild: {guild.name} ({guild.id})")
+        logger.info(f"Joined guild: {guild.name} ({guild.id})")
         
     async def on_guild_remove(self, guild: discord.Guild):
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            cur.execute("DELETE FROM guilds WHERE id = (?)", [str(guild.id)])
-            con.commit()
+        await self.db.remove_guild(guild.id)
+        self.subscriptions.remove_guild(guild.id)
+        self.guild_settings.invalidate(guild.id)
         await self.owner.send(f"Left guild: {guild.name}")
-        logging.info(f"Left guild: {guild.id}")
+        logger.info(f"Left guild: {guild.id}")
     
     async def on_error(self, event):
         type, value, tb = sys.exc_info()
-        logging.critical(f"Error in {event}\n{type}, {value}.")
-        logging.debug(f"Trackback: {traceback.format_tb(tb)}")
+        logger.critical(f"Error in {event}\n{type}, {value}.")
+        logger.debug("Traceback:", exc_info=True)
         self.owner.send(f"Error in {event}\n{type}, {value}.\nTraceback: {traceback.format_tb(tb)}")
     
-    async def make_or_update_tables(self, con, cur):
-        #Check if guilds table exists, update or create if necessary
-        guilds = [guild async for guild in bot.fetch_guilds(limit=150)]
-        cur.execute(''' SELECT count(*) FROM sqlite_master WHERE type='table' AND name='guilds' ''')
-        if cur.fetchone()[0]==1: #Guilds table already exists
-            for guild in guilds: #Add guilds that were joined while bot was offline
-                guildentries = cur.execute("SELECT * FROM guilds WHERE id = (?)", [str(guild.id)]).fetchall()
-                if guildentries == []:
-                    with sqlite3.connect(DB_NAME) as con:
-                        cur = con.cursor()
-                        cur.execute("INSERT OR IGNORE INTO guilds VALUES (?, ?, ?, ?)", (str(guild.id), None, None, None))
-                        con.commit()
-                    logging.info(f"Added guild on start: {guild.id}")
-        else: #Guilds table does not yet exist
-            logging.warning(f"New guilds table created. This is expected on a first start")
-            cur.execute('''CREATE TABLE guilds
-                        (id, updates_channel, modrole, subscribedmods, UNIQUE(id))''')
-            for guild in guilds:
-                guildentries = cur.execute("SELECT * FROM guilds WHERE id = (?)", [str(guild.id)]).fetchall()
-                if guildentries == []:
-                    with sqlite3.connect(DB_NAME) as con:
-                        cur = con.cursor()
-                        cur.execute("INSERT OR IGNORE INTO guilds VALUES (?, ?, ?, ?)", (str(guild.id), None, None, None))
-                        con.commit()
-                    logging.info(f"Added guild on start: {guild.id}")
-
-        #Check if mods table exists, create if necessary
-        cur.execute(''' SELECT count(name) FROM sqlite_master WHERE type='table' AND name='mods' ''')
-        if cur.fetchone()[0]!=1: #Mods table does not yet exist - download full database and create database.
-            logging.warning("New mods table created. This is expected on a first start.")
-            url = "https://mods.factorio.com/api/mods?page_size=max"
-            mods = await get_mods(url)
-            cur.execute('''CREATE TABLE mods
-                    (name, release_date, title, owner, version, factorio_version, UNIQUE(name))''')
-            cur.executemany("INSERT OR IGNORE INTO mods VALUES (?, ?, ?, ?, ?, ?)", mods)
-            con.commit()
-
-bot = MyBot(command_prefix=PREFIX, intents=intents)
-bot.run(TOKEN)
\ No newline at end of file
+    async def make_or_update_tables(self) -> int:
+        """
+        Creates or updates all tables and reconciles the guilds table with the guilds the bot is in.
+
+        Returns the next catalog page to load, or None if the catalog is complete.
+        """
+        start = time.monotonic()
+        guild_ids = {str(guild.id) async for guild in bot.fetch_guilds(limit=None)}
+        fetched = time.monotonic()
+        next_page = await self.db.run(make_tables, guild_ids)
+        logger.info(f"Fetched {len(guild_ids)} guilds in {fetched - start:.2f}s, updated tables in {time.monotonic() - fetched:.2f}s")
+        return next_page
+
+    async def bootstrap_catalog(self):
+        """
+        Fills the mods table from the mod portal, one bounded page at a time.
+
+        Each page is stored together with the number of the next page, so an interrupted bootstrap resumes where it
+        stopped, also in another process. Only the poller downloads pages. Mod update checks wait until the catalog is
+        complete.
+        """
+        failures = 0
+        while True:
+            if not self.is_poller:
+                await asyncio.sleep(POLLER_LEASE_RENEW)
+                continue
+            page = await self.db.run(next_catalog_page)
+            if page is None:
+                break
+            logger.info(f"Loading mod catalog page {page}")
+            url = f"{PORTAL_URL}/api/mods?page_size={BOOTSTRAP_PAGE_SIZE}&page={page}&sort=created_at&sort_order=asc"
+            try:
+                mods, count, page_count = await self.portal.get_mods_page(url)
+            except ConnectionError as error:
+                failures += 1
+                logger.warning(f"Connection Error while loading mod catalog: {error}")
+                await asyncio.sleep(min(300, 5 * 2 ** failures))
+                continue
+            failures = 0
+            done = count < BOOTSTRAP_PAGE_SIZE or (page_count is not None and page >= page_count)
+            await self.db.run(self.store_catalog_page, mods, None if done else page + 1)
+            self.mod_feed.publish(mods)
+        logger.info("Mod catalog loaded")
+        self.catalog_ready.set()
+
+    def store_catalog_page(self, cur, mods: list, next_page: int) -> None:
+        cur.executemany("INSERT OR IGNORE INTO mods VALUES (?, ?, ?, ?, ?, ?)", mods)
+        if next_page is None:
+            cur.execute("DELETE FROM bootstrap")
+        else:
+            cur.execute("UPDATE bootstrap SET next_page = (?)", [next_page])
+
+bot = MyBot(command_prefix=PREFIX, intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+bot.run(TOKEN, log_handler=None)
\ No newline at end of file
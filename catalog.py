@@ -0,0 +1,73 @@
+import sys
+
+
+class ModRecord:
+    '''
+    Catalog entry of a single mod.
+    '''
+    __slots__ = ("name", "title", "owner", "factorio_version")
+
+    def __init__(self, name: str, title: str, owner: str, factorio_version: str) -> None:
+        self.name = name
+        self.title = title
+        self.owner = owner
+        self.factorio_version = factorio_version
+
+    def astuple(self) -> tuple:
+        return (self.name, self.title, self.owner, self.factorio_version)
+
+
+class ModCatalog:
+    '''
+    In-memory catalog of all mods, keyed by name.
+
+    Records use __slots__ and share a single copy of each owner and Factorio version string, which repeat across many
+    mods. One catalog is kept on the bot and updated from the mod change feed, so every cog reads the same copy.
+    '''
+    def __init__(self) -> None:
+        self.mods = {}
+
+    def __len__(self) -> int:
+        return len(self.mods)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.mods
+
+    def get(self, name: str) -> ModRecord:
+        return self.mods.get(name)
+
+    def rows(self):
+        """
+        Yields (name, title, owner, factorio_version) for every mod.
+        """
+        for record in self.mods.values():
+            yield record.astuple()
+
+    def update(self, name: str, title: str, owner: str, factorio_version: str) -> None:
+        record = self.mods.get(name)
+        if record is not None and record.astuple() == (name, title, owner, factorio_version):
+            return
+        self.mods[name] = ModRecord(name, title, sys.intern(owner), sys.intern(factorio_version))
+
+    def remove(self, name: str) -> None:
+        self.mods.pop(name, None)
+
+    def sync(self, mods: list) -> None:
+        """
+        Brings the catalog in line with a full list of (name, title, owner, factorio_version) tuples.
+        """
+        seen = set()
+        for mod in mods:
+            seen.add(mod[0])
+            self.update(*mod)
+        for name in [name for name in self.mods if name not in seen]:
+            del self.mods[name]
+
+    def apply_mod_changes(self, mods: list, removed: list) -> None:
+        """
+        Applies inserted, updated and deleted mods from the mod change feed.
+        """
+        for name, release_date, title, owner, version, factorio_version in mods:
+            self.update(name, title, owner, factorio_version)
+        for name in removed:
+            self.remove(name)
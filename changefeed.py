@@ -0,0 +1,30 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ModChangeFeed:
+    '''
+    In-process feed of changes to the mods table.
+
+    Publishers pass the rows they inserted or updated, in the same [name, release date, title, owner, version,
+    factorio_version] format used by the mods table, and the names of mods they deleted. Subscribers are plain
+    callables taking (mods, removed) and are called synchronously.
+    '''
+    def __init__(self) -> None:
+        self.subscribers = []
+
+    def subscribe(self, callback) -> None:
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback) -> None:
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def publish(self, mods: list, removed: list = ()) -> None:
+        if not mods and not removed:
+            return
+        for callback in list(self.subscribers):
+            try:
+                callback(mods, removed)
+            except Exception as error:
+                logger.warning(f"{error} applying mod changes in {callback}")
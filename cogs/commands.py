@@ -1,17 +1,15 @@
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
-import sqlite3
-import aiohttp
-from fuzzywuzzy import process, fuzz
 from math import log10
-from misc import verify_user
+from misc import verify_user, verify_owner
+from search import ModSearchIndex
+from metrics import metrics, Histogram
 import os
 
 from typing import Literal
 
-SHARED_VOLUME = "."
-DB_NAME = f"{SHARED_VOLUME}/mods.db"
+MAX_SUGGESTIONS = 5
 
 class DeleteButton(discord.ui.View):
     def __init__(self, user: discord.Member):
@@ -34,6 +32,8 @@ class DeleteButton(discord.ui.View):
 class CommandCog(commands.Cog):
     def __init__(self, bot:commands.Bot) -> None:
         self.bot = bot
+        self.search_index = ModSearchIndex()
+        self.bot.mod_feed.subscribe(self.apply_mod_changes)
         self.update_mods_cache.start()
         try:
             with open("factorio_version.txt", "r") as f:
@@ -46,13 +46,29 @@ class CommandCog(commands.Cog):
     
     def cog_unload(self) -> None:
         self.update_mods_cache.cancel()
+        self.bot.mod_feed.unsubscribe(self.apply_mod_changes)
     
-    @tasks.loop(minutes=20)
+    @tasks.loop(hours=6)
     async def update_mods_cache(self):
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            modslist = cur.execute("SELECT name, title, owner, factorio_version FROM mods").fetchall()
-            self.modscache = [{"name": name, "title": title, "owner": owner, "factorio_version": factorio_version} for name, title, owner, factorio_version in modslist]
+        """
+        Full reconciliation of the mod catalog and search index with the database. Changes are normally applied as they
+        happen through the mod change feed, so this only serves as a safety net.
+        """
+        if self.update_mods_cache.current_loop != 0: #Catalog was just loaded on startup or is kept by the bot on reload
+            self.bot.catalog.sync(await self.bot.db.get_mods())
+        self.search_index.sync(self.bot.catalog.rows())
+
+    def apply_mod_changes(self, mods: list, removed: list) -> None:
+        """
+        Applies inserted, updated and deleted mods from the mod change feed to the search index.
+        The bot's catalog is updated first, so the index shares its strings.
+        """
+        for mod in mods:
+            record = self.bot.catalog.get(mod[0])
+            if record is not None:
+                self.search_index.update(*record.astuple())
+        for name in removed:
+            self.search_index.remove(name)
 
     @app_commands.command()
     @app_commands.check(verify_user)
@@ -61,10 +77,9 @@ class CommandCog(commands.Cog):
         '''
         Sets the channel in which mod updates are posted.
         '''
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            cur.execute("UPDATE guilds SET updates_channel = (?) WHERE id = (?)", [str(channel.id), str(interaction.guild_id)])
-            con.commit()
+        await self.bot.db.set_channel(interaction.guild_id, channel.id)
+        self.bot.subscriptions.set_channel(interaction.guild_id, channel.id)
+        self.bot.guild_settings.invalidate(interaction.guild_id)
         await interaction.response.send_message(f"Mod updates channel set to <#{channel.id}>", ephemeral=False)
 
     @app_commands.command()
@@ -74,10 +89,8 @@ class CommandCog(commands.Cog):
         '''
         Sets the role needed to change bot settings. Server admins always can.
         '''
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            cur.execute("UPDATE guilds SET modrole = (?) WHERE id = (?)", [str(role.id), str(interaction.guild_id)])
-            con.commit()
+        await self.bot.db.set_modrole(interaction.guild_id, role.id)
+        self.bot.guild_settings.invalidate(interaction.guild_id)
         await interaction.response.send_message(f"Modrole set to <@&{role.id}>", ephemeral=False)
     
     @app_commands.command()
@@ -87,49 +100,42 @@ class CommandCog(commands.Cog):
         """
         Add a mod to the subscription list of this server.
 
-        Notifications will only be sent for subscribed mods. Autocomplete may take up to 20 minutes to update.
-        """
-        with sqlite3.connect(DB_NAME) as con:
-            if modname in [mod["name"] for mod in self.modscache]:
-                cur = con.cursor()
-                subscribedmods = cur.execute("SELECT subscribedmods FROM guilds WHERE id = (?)", [str(interaction.guild_id)]).fetchall()[0][0]
-                
-                if subscribedmods is not None:
-                    subscribedmods = subscribedmods.split(", ")
-                    if modname not in subscribedmods:
-                        subscribedmods.append(modname)
-                        subscribedmods = ", ".join(subscribedmods)
-                        cur.execute("UPDATE guilds SET subscribedmods = (?) WHERE id = (?)", [subscribedmods, str(interaction.guild_id)])
-                        con.commit()
-                        await interaction.response.send_message(f"{modname} added to subscription list", ephemeral=False)
-                    else:
-                        await interaction.response.send_message(f"{modname} already in subscription list", ephemeral=True)
-                else: 
-                    subscribedmods = modname
-                    cur.execute("UPDATE guilds SET subscribedmods = (?) where id = (?)", [subscribedmods, str(interaction.guild_id)])
-                    con.commit()
-                    await interaction.response.send_message(f"{modname} added to subscription list", ephemeral=False)
+        Notifications will only be sent for subscribed mods.
+        """
+        if modname in self.bot.catalog:
+            if await self.bot.db.add_subscription(interaction.guild_id, modname):
+                self.bot.subscriptions.add_subscription(interaction.guild_id, modname)
+                self.bot.guild_settings.invalidate(interaction.guild_id)
+                await interaction.response.send_message(f"{modname} added to subscription list", ephemeral=False)
             else:
-                await interaction.response.send_message("Invalid mod name", ephemeral=True)
+                await interaction.response.send_message(f"{modname} already in subscription list", ephemeral=True)
+        else:
+            await interaction.response.send_message("Invalid mod name", ephemeral=True)
     
     @add_subscription.autocomplete("modname")
     async def modname_autocomplete(self, interaction: discord.Interaction, current: str):
-        return [app_commands.Choice(name=mod["title"][0:100], value=mod["name"]) for mod in self.modscache if current.lower() in mod["name"].lower() or current.lower() in mod["title"].lower()][0:25]
+        with metrics.time("autocomplete_seconds", command="add_subscription"):
+            return [app_commands.Choice(name=title[0:100], value=name) for name, title, owner, factorio_version in self.find_matches(current, None, owners=False)]
 
     @app_commands.command()
     @app_commands.check(verify_user)
     @app_commands.guild_only()
     async def show_subscriptions(self, interaction: discord.Interaction):
         """
-        Shows the mods this server is subscribed to.
+        Shows the mods and authors this server is subscribed to.
         """
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            subscribedmods = cur.execute("SELECT subscribedmods FROM guilds WHERE id = (?)", [str(interaction.guild_id)]).fetchall()[0][0]
-            if subscribedmods is not None:
-                await interaction.response.send_message(f"Mods this server is subscribed to: {subscribedmods}", ephemeral=False)
-            else:
-                await interaction.response.send_message("This server is not subscribed to any mods. All updates will be sent.", ephemeral=False)
+        settings = await self.bot.guild_settings.get(interaction.guild_id)
+        subscribedmods = sorted(settings.subscriptions)
+        authors = sorted(settings.authors)
+        if subscribedmods != [] or authors != []:
+            lines = []
+            if subscribedmods != []:
+                lines.append(f"Mods this server is subscribed to: {', '.join(subscribedmods)}")
+            if authors != []:
+                lines.append(f"Authors this server is subscribed to: {', '.join(authors)}")
+            await interaction.response.send_message("\n".join(lines), ephemeral=False)
+        else:
+            await interaction.response.send_message("This server is not subscribed to any mods. All updates will be sent.", ephemeral=False)
 
     @app_commands.command()
     @app_commands.check(verify_user)
@@ -138,34 +144,73 @@ class CommandCog(commands.Cog):
         """
         Remove a mod from the list of subscriptions.
         """
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            modslist = cur.execute("SELECT subscribedmods FROM guilds WHERE id = (?)", [str(interaction.guild_id)]).fetchall()[0][0]
-            modslist = modslist.split(", ")
-            if modname in modslist:
-                modslist.remove(modname)
-                modslist = ", ".join(modslist)
-                if modslist == "":
-                    modslist = None
-                cur.execute("UPDATE guilds SET subscribedmods = (?) WHERE id = (?)", [modslist, str(interaction.guild_id)])
-                con.commit()
-                if modslist == None:
-                    await interaction.response.send_message(f"{modname} removed from subscriptions. \n\nSubscription list empty, sending all mod updates.", ephemeral=False)
-                else: 
-                    await interaction.response.send_message(f"{modname} removed from subscriptions", ephemeral=False)
-            else:
-                await interaction.response.send_message(f"{modname} not found in subscriptions", ephemeral=True)
+        removed, remaining = await self.bot.db.remove_subscription(interaction.guild_id, modname)
+        if removed:
+            self.bot.subscriptions.remove_subscription(interaction.guild_id, modname)
+            self.bot.guild_settings.invalidate(interaction.guild_id)
+            if not remaining:
+                await interaction.response.send_message(f"{modname} removed from subscriptions. \n\nSubscription list empty, sending all mod updates.", ephemeral=False)
+            else: 
+                await interaction.response.send_message(f"{modname} removed from subscriptions", ephemeral=False)
+        else:
+            await interaction.response.send_message(f"{modname} not found in subscriptions", ephemeral=True)
 
     @remove_subscription.autocomplete("modname")
     async def unsub_autocomplete(self, interaction: discord.Interaction, current: str):
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            modslist = cur.execute("SELECT subscribedmods FROM guilds WHERE id = (?)", [str(interaction.guild_id)]).fetchall()[0][0]
-            if modslist != None:
-                modslist = modslist.split(", ")
-                return [app_commands.Choice(name=name, value=name) for name in modslist if current.lower() in name.lower()]
+        with metrics.time("autocomplete_seconds", command="remove_subscription"):
+            subscribedmods = (await self.bot.guild_settings.get(interaction.guild_id)).subscriptions
+            modslist = sorted(name for name in subscribedmods if current.lower() in name.lower())
+            return [app_commands.Choice(name=name, value=name) for name in modslist[0:25]]
+
+    @app_commands.command()
+    @app_commands.check(verify_user)
+    @app_commands.guild_only()
+    async def add_author_subscription(self, interaction: discord.Interaction, author: str):
+        """
+        Subscribe to all mods of an author.
+
+        Notifications will only be sent for subscribed mods and authors.
+        """
+        owner = await self.bot.db.find_owner(author)
+        if owner is not None:
+            if await self.bot.db.add_author_subscription(interaction.guild_id, owner):
+                self.bot.subscriptions.add_author_subscription(interaction.guild_id, owner)
+                self.bot.guild_settings.invalidate(interaction.guild_id)
+                await interaction.response.send_message(f"Mods by {owner} added to subscription list", ephemeral=False)
+            else:
+                await interaction.response.send_message(f"{owner} already in subscription list", ephemeral=True)
+        else:
+            await interaction.response.send_message("Invalid author name", ephemeral=True)
+
+    @add_author_subscription.autocomplete("author")
+    async def author_autocomplete(self, interaction: discord.Interaction, current: str):
+        with metrics.time("autocomplete_seconds", command="add_author_subscription"):
+            return [app_commands.Choice(name=owner, value=owner) for owner in await self.bot.db.search_owners(current)]
+
+    @app_commands.command()
+    @app_commands.check(verify_user)
+    @app_commands.guild_only()
+    async def remove_author_subscription(self, interaction: discord.Interaction, author: str):
+        """
+        Remove an author from the list of subscriptions.
+        """
+        removed, remaining = await self.bot.db.remove_author_subscription(interaction.guild_id, author)
+        if removed:
+            self.bot.subscriptions.remove_author_subscription(interaction.guild_id, author)
+            self.bot.guild_settings.invalidate(interaction.guild_id)
+            if not remaining:
+                await interaction.response.send_message(f"{author} removed from subscriptions. \n\nSubscription list empty, sending all mod updates.", ephemeral=False)
             else:
-                return []
+                await interaction.response.send_message(f"{author} removed from subscriptions", ephemeral=False)
+        else:
+            await interaction.response.send_message(f"{author} not found in subscriptions", ephemeral=True)
+
+    @remove_author_subscription.autocomplete("author")
+    async def author_unsub_autocomplete(self, interaction: discord.Interaction, current: str):
+        with metrics.time("autocomplete_seconds", command="remove_author_subscription"):
+            authors = (await self.bot.guild_settings.get(interaction.guild_id)).authors
+            authorslist = sorted(owner for owner in authors if current.lower() in owner.lower())
+            return [app_commands.Choice(name=owner, value=owner) for owner in authorslist[0:25]]
     
     @app_commands.command()
     async def find_mod(self, interaction: discord.Interaction, modname: str, version: Literal["latest", "any", "1.1", "1.0", "0.18", "0.17", "0.16", "0.15", "0.14", "0.13"] = "latest"):
@@ -173,10 +218,15 @@ class CommandCog(commands.Cog):
         Find mods by name.
         """
         view = DeleteButton(interaction.user)
-        if modname in [mod["name"] for mod in self.modscache]:
+        if modname in self.search_index:
             embed = await self.make_embed(modname)
         else:
-            embed = await self.make_error_embed(modname, version)
+            suggestions = [mod for score, mod in self.search_index.fuzzy(modname, self.search_version(version), MAX_SUGGESTIONS)]
+            match = self.search_index.best_match(modname, suggestions)
+            if match is not None:
+                embed = await self.make_embed(match[0])
+            else:
+                embed = await self.make_error_embed(modname, version, suggestions)
         await interaction.response.send_message(content=None, embed=embed, view=view)
         await view.wait()
         if view.value:
@@ -184,52 +234,61 @@ class CommandCog(commands.Cog):
 
     @find_mod.autocomplete("modname")
     async def find_autocomplete(self, interaction: discord.Interaction, current: str):
-        if not interaction.namespace.version:
-            version = "latest"
-        else:
-            version = interaction.namespace.version
+        with metrics.time("autocomplete_seconds", command="find_mod"):
+            version = self.search_version(interaction.namespace.version or "latest")
+            if version is None:
+                autofill = [app_commands.Choice(name=f"[{factorio_version}] {title[0:60]} by {owner}", value=name)
+                    for name, title, owner, factorio_version in self.find_matches(current, None)]
+                return autofill
 
-        if interaction.namespace.version == "any":
-            autofill = [app_commands.Choice(name=f"[{mod['factorio_version']}] {mod['title'][0:60]} by {mod['owner']}", value=mod['name'])
-                for mod in self.modscache
-                if current.lower() in mod['name'].lower() or current.lower() in mod['title'].lower() or current.lower() in mod['owner'].lower()][0:25]
+            autofill = [app_commands.Choice(name=f"{title[0:60]} by {owner}", value=name)
+                for name, title, owner, factorio_version in self.find_matches(current, version)]
             return autofill
 
-        if version == "latest":
-            with open("factorio_version.txt", "r") as f:
-                version = f.read().strip()
+    def search_version(self, version: str) -> str:
+        """
+        Translates the version option of a search into a Factorio version, or None for any version.
+        """
+        if version == "any":
+            return None
+        elif version == "latest":
+            return self.factorio_version
+        return version
 
-        autofill = [app_commands.Choice(name=f"{mod['title'][0:60]} by {mod['owner']}", value=mod['name'])
-            for mod in self.modscache
-            if (current.lower() in mod['name'].lower() or current.lower() in mod['title'].lower() or current.lower() in mod['owner'].lower())
-            and mod['factorio_version'] == version][0:25]
-        return autofill
+    def find_matches(self, current: str, factorio_version: str, owners: bool = True) -> list:
+        """
+        Returns up to 25 mods matching the query, topped up with fuzzy matches if there are too few exact matches.
+        """
+        matches = self.search_index.search(current, factorio_version, owners)
+        if len(matches) < 25 and len(current) >= 3:
+            for score, mod in self.search_index.fuzzy(current, factorio_version):
+                if mod not in matches:
+                    matches.append(mod)
+            matches = matches[0:25]
+        return matches
         
     async def make_embed(self, name: str):
         """
         Creates an embed for the search result.
         """
-        url = f"https://mods.factorio.com/api/mods/{name}".replace(" ", "%20")
         userurl = f"https://mods.factorio.com/mod/{name}".replace(" ", "%20")
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(url) as response:
-                if response.ok == True:
-                    json = await response.json()
-                    owner = json["owner"].replace("_", "\_").replace("*", "\*").replace("~","\~").replace("@", "@​\u200b")
-                    embed = discord.Embed(title=json["title"][0:200], color=0x2ECC71, url=userurl, description=json["summary"])
-                    embed.add_field(name="Owner", value=owner, inline=True)
-                    embed.add_field(name="Downloads", value=json["downloads_count"], inline=True)
-                    if "thumbnail" in json:
-                        thumbnailraw = json["thumbnail"]
-                        if thumbnailraw != "/assets/.thumb.png":
-                            thumbnailURL = "https://assets-mod.factorio.com" + thumbnailraw
-                            embed.set_thumbnail(url=thumbnailURL)
-                    return embed
-                else:
-                    return None
-
-    async def make_error_embed(self, modname, factorio_version):
-        desc = f"None of the `{len(self.modscache)}` cached mods match your search for '{modname}'. The mod you are \
+        json = await self.bot.portal.get_mod(name)
+        if json is not None:
+            owner = json["owner"].replace("_", "\_").replace("*", "\*").replace("~","\~").replace("@", "@​\u200b")
+            embed = discord.Embed(title=json["title"][0:200], color=0x2ECC71, url=userurl, description=json["summary"])
+            embed.add_field(name="Owner", value=owner, inline=True)
+            embed.add_field(name="Downloads", value=json["downloads_count"], inline=True)
+            if "thumbnail" in json:
+                thumbnailraw = json["thumbnail"]
+                if thumbnailraw != "/assets/.thumb.png":
+                    thumbnailURL = "https://assets-mod.factorio.com" + thumbnailraw
+                    embed.set_thumbnail(url=thumbnailURL)
+            return embed
+        else:
+            return None
+
+    async def make_error_embed(self, modname, factorio_version, suggestions: list = None):
+        desc = f"None of the `{len(self.bot.catalog)}` cached mods match your search for '{modname}'. The mod you are \
         looking for may not be available"
         if factorio_version == "any":
             pass
@@ -240,11 +299,13 @@ class CommandCog(commands.Cog):
         desc += ", or may not be cached yet."
 
         embed = discord.Embed(title="Mod not found", color=0xE74C3C, description=desc)
+        if suggestions:
+            embed.add_field(name="Did you mean", value="\n".join(f"{title[0:60]} (`{name}`)" for name, title, owner, version in suggestions), inline=False)
         return embed
 
     @app_commands.command()
     @app_commands.guilds(763041705024552990)
-    @commands.is_owner()
+    @app_commands.check(verify_owner)
     async def set_latest_factorio_version(self, interaction: discord.Interaction, version: str):
         """
         Set latest factorio version for use in searches.
@@ -256,7 +317,7 @@ class CommandCog(commands.Cog):
     
     @app_commands.command()
     @app_commands.guilds(763041705024552990)
-    @commands.is_owner()
+    @app_commands.check(verify_owner)
     async def update_commands(self, interaction: discord.Interaction):
         """
         Synchronize all commands with source code.
@@ -266,7 +327,7 @@ class CommandCog(commands.Cog):
 
     @app_commands.command()
     @app_commands.guilds(763041705024552990)
-    @commands.is_owner()
+    @app_commands.check(verify_owner)
     async def update_cogs(self, interaction: discord.Interaction):
         """
         Reload all cogs.
@@ -283,7 +344,7 @@ class CommandCog(commands.Cog):
 
     @app_commands.command()
     @app_commands.guilds(763041705024552990)
-    @commands.is_owner()
+    @app_commands.check(verify_owner)
     async def shutdown(self, interaction: discord.Interaction):
         """
         Stops the bot.
@@ -291,15 +352,54 @@ class CommandCog(commands.Cog):
         await interaction.response.send_message("Shutting down...")
         exit()
 
+    @app_commands.command()
+    @app_commands.guilds(763041705024552990)
+    @app_commands.check(verify_owner)
+    async def stats(self, interaction: discord.Interaction):
+        """
+        Shows where the bot spends its time.
+        """
+        pages = metrics.series("poll_pages_total")
+        updates = metrics.series("mod_updates_total")
+        failures = metrics.series("delivery_failures_total")
+        statements = sorted(metrics.series("db_query_seconds").items(), key=lambda item: -item[1].sum)[0:5]
+
+        embed = discord.Embed(colour=0x5865F2, title="Bot statistics")
+        embed.add_field(name="Update checks", inline=False, value="\n".join([
+            f"Ticks: {format_histogram(metrics.histogram('poll_tick_seconds'))}",
+            f"Diff: {format_histogram(metrics.histogram('poll_diff_seconds'))}",
+            f"Pages: {format_counts(pages, 'result')}, {metrics.value('poll_failures_total') + metrics.value('poll_errors_total'):.0f} failed",
+            f"Updates: {format_counts(updates, 'tag')}",
+            f"Interval: {metrics.value('poll_interval_seconds'):.0f}s, outbox depth {metrics.value('outbox_depth'):.0f}"]))
+        embed.add_field(name="Mod portal", inline=False, value="\n".join([
+            f"Mod lists: {format_histogram(metrics.histogram('portal_request_seconds', endpoint='mods'))}",
+            f"Mod details: {format_histogram(metrics.histogram('portal_request_seconds', endpoint='mod'))}",
+            f"Errors: {format_counts(metrics.series('portal_errors_total'), 'endpoint')}"]))
+        embed.add_field(name="Delivery", inline=False, value="\n".join([
+            f"Sends: {format_histogram(metrics.histogram('delivery_send_seconds'))}",
+            f"Failures: {format_counts(failures, 'reason')}",
+            f"Rate limit waits: {metrics.histogram('delivery_ratelimit_wait_seconds', bucket='channel').sum:.1f}s channel, "
+            f"{metrics.histogram('delivery_ratelimit_wait_seconds', bucket='global').sum:.1f}s global"]))
+        embed.add_field(name="Database (top 5 by total time)", inline=False, value="\n".join(
+            f"`{dict(labels)['statement'][0:50]}`: {histogram.sum:.2f}s, {format_histogram(histogram)}"
+            for labels, histogram in statements) or "No queries yet")
+        caches = []
+        for cache in ["mod_details", "guild_settings", "fuzzy_search"]:
+            hits = metrics.value("cache_hits_total", cache=cache)
+            lookups = hits + metrics.value("cache_misses_total", cache=cache)
+            caches.append(f"{cache}: {hits / lookups * 100 if lookups > 0 else 0:.0f}% of {lookups:.0f}")
+        embed.add_field(name="Cache hit rates", inline=False, value="\n".join(caches))
+        embed.add_field(name="Autocomplete", inline=False, value="\n".join(
+            f"{command}: {format_histogram(metrics.histogram('autocomplete_seconds', command=command))}"
+            for command in ["find_mod", "add_subscription", "remove_subscription", "add_author_subscription", "remove_author_subscription"]))
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @app_commands.command()
     async def botinfo(self, interaction: discord.Interaction):
         """
         Shows info about the bot.
         """
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            servers = cur.execute("SELECT * FROM guilds").fetchall()
-            servercount = len(servers)
+        servercount = await self.bot.db.guild_count()
         embed = discord.Embed(colour=0x5865F2, title="Factorio Mod Notifier")
         embed.add_field(name="Number of servers", value=servercount, inline=False)
         embed.add_field(name="Creator", value="SpeckledFleebeedoo#8679 (<@247640901805932544>)", inline=False)
@@ -308,5 +408,13 @@ class CommandCog(commands.Cog):
         embed.add_field(name = "Info", value="To set up the bot on a new server, use /set_channel. No notifications will be sent without a channel set.")
         await interaction.response.send_message(embed=embed)
 
+def format_counts(series: dict, label: str) -> str:
+    return ", ".join(f"{dict(labels)[label]} {count:.0f}" for labels, count in series.items()) or "none"
+
+def format_histogram(histogram: Histogram) -> str:
+    if histogram.count == 0:
+        return "no samples"
+    return f"{histogram.count} samples, p50 {histogram.quantile(0.5) * 1000:.0f}ms, p99 {histogram.quantile(0.99) * 1000:.0f}ms"
+
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(CommandCog(bot))
\ No newline at end of file
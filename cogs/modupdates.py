@@ -2,65 +2,272 @@ import discord
 from discord.ext import commands
 from discord.ext import tasks
 import sqlite3
-import aiohttp
 import traceback
 import logging
-from misc import get_mods
+import asyncio
+import os
+import time
+import random
+import json
+from datetime import datetime, timezone
+from delivery import Delivery
+from portal import PORTAL_URL
+from metrics import metrics
 
 MAX_TITLE_LENGTH = 128
 TRIMMED = "<trimmed>"
-SHARED_VOLUME = "."
-DB_NAME = f"{SHARED_VOLUME}/mods.db"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+OUTBOX_BATCH = 1000
+OUTBOX_CHANNEL_BATCH = 50 #Five messages of 10 embeds, the burst the per-channel rate limit allows
+OUTBOX_MAX_ATTEMPTS = 8
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS = 6000
+MAX_QUERY_PARAMETERS = 500
+RENDER_CONCURRENCY = 8
+UPDATES_PAGE_SIZE = 10
+CATCHUP_PAGE_SIZE = 100
+CATCHUP_WINDOW = 4
+CATCHUP_AGE = 15 * 60
+POLL_INTERVAL = 60
+MIN_POLL_INTERVAL = 20
+MAX_POLL_INTERVAL = 180
+MAX_POLL_BACKOFF = 900
+RECONCILE_HOURS = 24
+RECONCILE_PAGE_SIZE = 500
+RECONCILE_CONCURRENCY = 2
+RECONCILE_PAGE_DELAY = 2
+RECONCILE_DELETE_CHUNK = 1000
+RECONCILE_FIXTURE = os.getenv("RECONCILE_FIXTURE")
+
+logger = logging.getLogger(__name__)
 
 class ModUpdates(commands.Cog):
     def __init__(self, bot:commands.Bot) -> None:
         self.bot = bot
+        self.delivery = Delivery(bot)
+        self.render_slots = asyncio.Semaphore(RENDER_CONCURRENCY)
+        self.outbox_events = [asyncio.Event() for _ in range(OUTBOX_WORKERS)]
+        self.outbox_workers = []
+        self.outbox_depth = 0
+        self.watermark = None
+        self.last_checked = None
+        self.poll_interval = POLL_INTERVAL
+        self.poll_failures = 0
+        self.poll_failed = False
+        self.next_poll_delay = POLL_INTERVAL
+        self.tick_latency = 0.0
         self.check_mod_updates.start()
+        self.reconcile_catalog.start()
+
+    async def cog_load(self) -> None:
+        self.outbox_workers = [asyncio.create_task(self.outbox_worker(i)) for i in range(OUTBOX_WORKERS)]
     
     def cog_unload(self) -> None:
         self.check_mod_updates.cancel()
+        self.reconcile_catalog.cancel()
+        for worker in self.outbox_workers:
+            worker.cancel()
     
-    @tasks.loop(minutes=1)
+    @tasks.loop(seconds=POLL_INTERVAL)
     async def check_mod_updates(self):
-        logging.debug("Checking for mod updates")
+        if not self.bot.is_poller:
+            logger.debug("Not holding the poller lease, skipping mod update check")
+            return
+        logger.debug("Checking for mod updates")
+        start = time.monotonic()
+        updatelist = []
+        self.poll_failed = False
         try:
+            await self.bot.refresh_subscriptions()
             updatelist = await self.check_updates()
             if updatelist != []:
-                await self.send_update_messages(updatelist)
-                logging.debug(f"Sending messages for: {updatelist}")
+                logger.debug(f"Queued messages for: {updatelist}")
+                self.wake_outbox_workers()
             else:
-                logging.debug("No updates found")
+                logger.debug("No updates found")
+            self.outbox_depth = await self.bot.db.outbox_depth()
+            metrics.set("outbox_depth", self.outbox_depth)
+            if self.outbox_depth > 0:
+                logger.info(f"Outbox depth: {self.outbox_depth}")
 
-        except discord.DiscordServerError:
-            logging.warning("Discord server error")
-            pass
         except Exception as error:
-            logging.warning(f"{error} checking mod updates")
-            logging.debug(f"Traceback:{traceback.format_exc()}")
+            self.bot.portal.forget_validators()
+            metrics.inc("poll_errors_total")
+            logger.warning(f"{error} checking mod updates")
+            logger.debug("Traceback:", exc_info=True)
             appinfo = await self.bot.application_info()
             owner = appinfo.owner
             await owner.send(traceback.format_exc())
-    
-    async def send_update_messages(self, updatelist: list):
-        for mod, tag in updatelist[::-1]:
-            logging.debug(f"Trying to send messages for updated mod: {[mod[2]]}")
-            name = mod[0]
-            title = mod[2]
-            owner = mod[3]
-            version = mod[4]
-            output = await self.create_embed(name, title, owner, version, tag)
-            
-            with sqlite3.connect(DB_NAME) as con:
-                cur = con.cursor()
-                channels = cur.execute("SELECT updates_channel FROM guilds WHERE updates_channel IS NOT NULL").fetchall()
-            for channelID in channels:
-                subscriptions = cur.execute("SELECT subscribedmods FROM guilds WHERE updates_channel = (?)", channelID).fetchall()[0][0]
-                if subscriptions != None:
-                    subscriptions = subscriptions.split(", ")
-                if subscriptions == None or name in subscriptions:
-                    channel = self.bot.get_channel(int(channelID[0]))
-                    await channel.send(embed=output)
-                    
+        finally:
+            self.tick_latency = time.monotonic() - start
+            metrics.observe("poll_tick_seconds", self.tick_latency)
+            self.schedule_next_poll(updatelist != [])
+
+    @check_mod_updates.before_loop
+    async def wait_for_catalog(self):
+        await self.bot.catalog_ready.wait()
+
+    def schedule_next_poll(self, found_updates: bool) -> None:
+        """
+        Adapts the polling interval: shorter while updates are flowing, longer when quiet, and backing off with jitter
+        while the mod portal is failing.
+        """
+        if self.poll_failed:
+            self.poll_failures += 1
+            delay = min(MAX_POLL_BACKOFF, self.poll_interval * 2 ** self.poll_failures) * random.uniform(0.8, 1.2)
+        else:
+            self.poll_failures = 0
+            if found_updates:
+                self.poll_interval = max(MIN_POLL_INTERVAL, self.poll_interval / 2)
+            else:
+                self.poll_interval = min(MAX_POLL_INTERVAL, self.poll_interval * 1.25)
+            delay = self.poll_interval
+        self.next_poll_delay = delay
+        metrics.set("poll_interval_seconds", delay)
+        self.check_mod_updates.change_interval(seconds=delay)
+        logger.debug(f"Mod update check took {self.tick_latency:.2f}s, next check in {delay:.0f}s")
+
+    def enqueue_updates(self, cur: sqlite3.Cursor, updatedmods: list, routes: dict) -> None:
+        """
+        Adds one outbox entry per destination channel for each updated mod. Runs on the database thread, so the
+        destination channels are looked up beforehand and passed in as a dict of mod name to (channel ID, guild ID).
+
+        Entries are unique per (mod, version, channel), so re-detecting an update does not queue it twice.
+        """
+        entries = []
+        for mod, tag in updatedmods:
+            name, release_date, title, owner, version = mod[0:5]
+            for channelID, guildID in routes[name]:
+                entries.append((name, version, channelID, release_date, title, owner, tag, guildID))
+        cur.executemany("""INSERT OR IGNORE INTO outbox (mod_name, version, channel_id, release_date, title, owner, tag, guild_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", entries)
+
+    def wake_outbox_workers(self) -> None:
+        for event in self.outbox_events:
+            event.set()
+
+    async def outbox_worker(self, index: int):
+        """
+        Drains the outbox entries of the channels assigned to this worker.
+
+        Channels are partitioned over the workers, so each channel is only ever served by one worker and its updates
+        stay in order. Each batch takes a few messages' worth of entries from many channels, which are delivered in
+        parallel. When this process runs only some of the shards, only entries for guilds on those shards are
+        taken. Failed sends are retried with exponential backoff. If handling a batch fails unexpectedly, the whole
+        batch goes through the same backoff, so a bad entry cannot block its channels.
+        """
+        event = self.outbox_events[index]
+        await self.bot.wait_until_ready()
+        while True:
+            rows = []
+            try:
+                rows = await self.bot.db.due_outbox(OUTBOX_WORKERS, index, time.time(), OUTBOX_BATCH, OUTBOX_CHANNEL_BATCH, self.bot.shard_count, self.bot.shard_ids)
+                if rows != []:
+                    await self.send_update_messages(rows)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.warning(f"{error} in outbox worker {index}")
+                logger.debug("Traceback:", exc_info=True)
+                if rows != []:
+                    try:
+                        await self.retry_outbox_entries(rows)
+                    except Exception as error:
+                        logger.warning(f"{error} rescheduling outbox entries in worker {index}")
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send_update_messages(self, rows: list):
+        """
+        Sends a batch of outbox entries and removes them from the outbox once delivered.
+
+        Updates for the same channel are combined into messages of up to 10 embeds, in release order. Entries whose
+        embed could not be rendered are retried like failed sends.
+        """
+        embeds = await self.render_embeds(rows)
+        done = []
+        retry = []
+        dropped = 0
+        chunks = {}
+        for row in rows:
+            rowid, name, version, channelID, title, owner, tag, attempts = row
+            embed = embeds[name, version]
+            if embed is None:
+                dropped += self.schedule_retry(row, done, retry)
+                continue
+            channelchunks = chunks.setdefault(channelID, [])
+            if channelchunks == [] or len(channelchunks[-1]) == MAX_EMBEDS_PER_MESSAGE \
+                    or sum(len(embeds[chunkrow[1], chunkrow[2]]) for chunkrow in channelchunks[-1]) + len(embed) > MAX_EMBED_CHARACTERS:
+                channelchunks.append([])
+            channelchunks[-1].append(row)
+        messages = {channelID: [{"embeds": [embeds[row[1], row[2]] for row in chunk]} for chunk in channelchunks]
+                    for channelID, channelchunks in chunks.items()}
+        results = await self.delivery.deliver(messages)
+
+        for channelID, channelchunks in chunks.items():
+            delivered = results[channelID]
+            for i, chunk in enumerate(channelchunks):
+                for row in chunk:
+                    if delivered is None or i < delivered:
+                        done.append((row[0],))
+                    else:
+                        dropped += self.schedule_retry(row, done, retry)
+        if dropped > 0:
+            logger.warning(f"Dropped {dropped} outbox entries after {OUTBOX_MAX_ATTEMPTS} attempts")
+        await self.bot.db.finish_outbox(done, retry)
+
+    async def retry_outbox_entries(self, rows: list):
+        """
+        Reschedules a batch of outbox entries that could not be handled.
+        """
+        done = []
+        retry = []
+        dropped = sum(self.schedule_retry(row, done, retry) for row in rows)
+        if dropped > 0:
+            logger.warning(f"Dropped {dropped} outbox entries after {OUTBOX_MAX_ATTEMPTS} attempts")
+        await self.bot.db.finish_outbox(done, retry)
+
+    def schedule_retry(self, row: tuple, done: list, retry: list) -> bool:
+        """
+        Adds a failed outbox entry to the retry list with exponential backoff, or to the done list once it has used up
+        its attempts. Returns whether the entry was given up on.
+        """
+        rowid, attempts = row[0], row[7]
+        if attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+            done.append((rowid,))
+            return True
+        retry.append((time.time() + min(2 ** attempts * 10, 3600), rowid))
+        return False
+
+    async def render_embeds(self, rows: list) -> dict:
+        """
+        Builds the embed for every distinct update in a batch of outbox entries once. Thumbnails are fetched
+        concurrently through a bounded pool, so rendering a batch takes about one portal round trip.
+
+        Returns a dict of (name, version) to embed, or to None if rendering failed.
+        """
+        updates = {}
+        for rowid, name, version, channelID, title, owner, tag, attempts in rows:
+            updates.setdefault((name, version), (name, title, owner, version, tag))
+
+        async def render(name, title, owner, version, tag):
+            async with self.render_slots:
+                logger.debug(f"Trying to send messages for updated mod: {[title]}")
+                try:
+                    return await self.create_embed(name, title, owner, version, tag)
+                except Exception as error:
+                    logger.warning(f"{error} rendering update for {name} {version}")
+                    logger.debug("Traceback:", exc_info=True)
+                    metrics.inc("delivery_failures_total", reason="render")
+                    return None
+
+        embeds = await asyncio.gather(*[render(*update) for update in updates.values()])
+        return dict(zip(updates, embeds))
+
     async def create_embed(self, name: str, title: str, owner: str, version: str, tag: str):
         title = await self.make_safe(title)
         if len(title) > MAX_TITLE_LENGTH:
@@ -85,48 +292,273 @@ class ModUpdates(commands.Cog):
 
     async def check_updates(self):
         """
-        Iterates through pages of recently updated mods until unchanged mods are found.
+        Iterates through pages of recently updated mods until the newest release processed by the previous check (the
+        watermark) is crossed, i.e. until a page holds no release newer than it. The listing is sorted by update time,
+        so mods whose details changed without a new release can appear between new releases and do not end the walk.
+
+        A normal tick fetches a single small page. When the last successful check is long ago, as after downtime or a
+        portal outage, larger pages are used, and following pages are prefetched concurrently. Before the first
+        successful check of this process, the age of the watermark is used instead. The watermark only moves forward
+        once a walk completed without errors, so a failed tick is walked again from the same point.
 
         Returns a list of [name, release date, title, owner, version]
         """
-        modupdated = True
-        i = 1
+        started = time.time()
+        if self.watermark is None:
+            self.watermark = await self.bot.db.newest_release()
+        watermark = self.watermark
+        newest = watermark
+        if self.last_checked is not None:
+            behind = started - self.last_checked
+        elif watermark is not None:
+            behind = self.release_age(watermark)
+        else:
+            behind = None
+        page_size = UPDATES_PAGE_SIZE
+        if behind is None or behind > CATCHUP_AGE:
+            page_size = CATCHUP_PAGE_SIZE
+            logger.info(f"Catching up on mod updates since {watermark}")
+
         updatelist = []
-        while modupdated == True:
-            url = f"https://mods.factorio.com/api/mods?page_size=10&page={i}&sort=updated_at&sort_order=desc"
+        page = 1
+        window = 1
+        while True:
+            fetches = [asyncio.ensure_future(self.fetch_page(page + i, page_size)) for i in range(window)]
+            crossed = False
             try:
-                mods = await get_mods(url)
-            except ConnectionError:
-                logging.warning("Connection Error while getting modlist")
+                for fetch in fetches:
+                    if crossed:
+                        break
+                    try:
+                        mods = await fetch
+                    except ConnectionError as error:
+                        logger.warning(f"Connection Error while getting modlist: {error}")
+                        metrics.inc("poll_failures_total")
+                        self.poll_failed = True
+                        #Make the next tick walk the pages again, even if the first page did not change
+                        self.bot.portal.forget_validators()
+                        crossed = True
+                        continue
+                    if mods is None:
+                        logger.debug("First page unchanged")
+                        metrics.inc("poll_pages_total", result="unchanged")
+                        crossed = True
+                        continue
+                    metrics.inc("poll_pages_total", result="changed")
+                    updatedmods = await self.compare_mods(mods)
+                    updatelist += updatedmods
+                    if mods != []:
+                        newest = max(newest or "", max(mod[1] for mod in mods))
+                    if watermark is not None:
+                        crossed = len(mods) < page_size or all(mod[1] <= watermark for mod in mods)
+                    else:
+                        crossed = len(mods) < page_size or len(updatedmods) != len(mods)
+            finally:
+                #Cancel prefetched pages that are no longer needed, also when processing a page raised
+                for fetch in fetches:
+                    fetch.cancel()
+                await asyncio.gather(*fetches, return_exceptions=True)
+            if crossed:
                 break
-            updatedmods = await self.compare_mods(mods)
-            if updatedmods != []:
-                updatelist += updatedmods
-            i += 1
-            if len(updatedmods) != 10:
-                modupdated = False
+            page += window
+            window = CATCHUP_WINDOW
+        if not self.poll_failed:
+            self.watermark = newest
+            self.last_checked = started
         return updatelist
 
+    def fetch_page(self, page: int, page_size: int):
+        """
+        Fetches a page of recently updated mods. The first page of a normal tick is fetched conditionally, returning
+        None if it did not change since the previous tick.
+        """
+        url = f"{PORTAL_URL}/api/mods?page_size={page_size}&page={page}&sort=updated_at&sort_order=desc"
+        if page == 1 and page_size == UPDATES_PAGE_SIZE:
+            return self.bot.portal.get_mods_if_changed(url)
+        return self.bot.portal.get_mods(url)
+
+    def release_age(self, released_at: str) -> float:
+        """
+        Returns the number of seconds since a portal release timestamp.
+        """
+        released = datetime.fromisoformat(released_at.replace("Z", "+00:00"))
+        return (datetime.now(timezone.utc) - released).total_seconds()
+
     async def compare_mods(self, mods: list) -> list:
         """
-        Compares mods in list to entries stored in database. Sends list of updated mods to messager. 
+        Compares mods in list to entries stored in database. Queues updated mods in the outbox in the same transaction.
 
         Returns a list of [name, release date, title, owner, version], tag
         """
+        with metrics.time("poll_diff_seconds"):
+            subscriptions = self.bot.subscriptions
+            routes = {mod[0]: [(channelID, subscriptions.channel_guilds.get(channelID)) for channelID in subscriptions.channels_for(mod[0], mod[3])] for mod in mods}
+            updatedmods = await self.bot.db.run(self.store_changes, mods, routes)
+        for mod, tag in updatedmods:
+            metrics.inc("mod_updates_total", tag=tag)
+            if tag == "u":
+                self.bot.portal.invalidate(mod[0])
+        self.bot.mod_feed.publish([mod for mod, tag in updatedmods])
+        return updatedmods
+
+    def store_changes(self, cur: sqlite3.Cursor, mods: list, routes: dict) -> list:
+        """
+        Stores new and updated mods and queues their notifications in one transaction. Runs on the database thread.
+
+        The stored versions are looked up in bulk and compared in memory, and all changes are written with one executemany.
+        """
+        existing = {}
+        for i in range(0, len(mods), MAX_QUERY_PARAMETERS):
+            names = [mod[0] for mod in mods[i:i + MAX_QUERY_PARAMETERS]]
+            existing.update(cur.execute(f"SELECT name, version FROM mods WHERE name IN ({', '.join('?' * len(names))})", names).fetchall())
         updatedmods = []
-        with sqlite3.connect(DB_NAME) as con:
-            cur = con.cursor()
-            for mod in mods:
-                existing_entry = cur.execute("SELECT * FROM mods WHERE name=:name", {"name": mod[0]}).fetchall()
-                if existing_entry == []:
-                    updatedmods.append([mod, "n"])
-                    cur.execute("INSERT INTO mods VALUES (?, ?, ?, ?, ?, ?)", mod)
-                elif existing_entry[0][4] != mod[4]:
-                    updatedmods.append([mod, "u"])
-                    cur.execute("INSERT OR REPLACE INTO mods VALUES (?, ?, ?, ?, ?, ?)", mod)
-            con.commit()
+        for mod in mods:
+            if mod[0] not in existing:
+                updatedmods.append([mod, "n"])
+            elif existing[mod[0]] != mod[4]:
+                updatedmods.append([mod, "u"])
+        cur.executemany("INSERT OR REPLACE INTO mods VALUES (?, ?, ?, ?, ?, ?)", [mod for mod, tag in updatedmods])
+        self.enqueue_updates(cur, updatedmods, routes)
         return updatedmods
 
+    @tasks.loop(hours=RECONCILE_HOURS)
+    async def reconcile_catalog(self):
+        """
+        Walks the full portal listing and brings the mods table in line with it, picking up releases missed during
+        outages, changed titles and owners, and deleted mods. No notifications are sent for these changes.
+
+        Pages are fetched a few at a time with a pause in between, never past the page count reported by the first
+        page, and every page is diffed and written in its own short transaction, so the update checks are never held up.
+        A mod is only deleted once it is missing from two consecutive complete runs. When the portal reports a page count,
+        the walk is only complete once that page is reached, and a short page before it aborts the run. Set RECONCILE_FIXTURE to the path of a JSON file in
+        the /api/mods format to reconcile against that file instead of the portal.
+        """
+        if not self.bot.is_poller:
+            return
+        start = time.monotonic()
+        cutoff = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        fixture = self.load_reconcile_fixture()
+        seen = set()
+        inserted = updated = pages = 0
+        page = 1
+        page_count = None
+        window = 1
+        complete = False
+        try:
+            while not complete:
+                if page_count is not None:
+                    window = min(window, page_count - page + 1)
+                results = await asyncio.gather(*[self.fetch_reconcile_page(page + i, fixture) for i in range(window)])
+                for i, (mods, count, listed_pages) in enumerate(results):
+                    pages += 1
+                    if listed_pages is not None:
+                        page_count = listed_pages
+                    seen.update(mod[0] for mod in mods)
+                    newmods, changedmods = await self.bot.db.run(self.reconcile_page, mods)
+                    inserted += len(newmods)
+                    updated += len(changedmods)
+                    for mod in changedmods:
+                        self.bot.portal.invalidate(mod[0])
+                    self.bot.mod_feed.publish(newmods + changedmods)
+                    if page_count is None:
+                        complete = count < RECONCILE_PAGE_SIZE
+                    elif page + i >= page_count:
+                        complete = True
+                    elif count < RECONCILE_PAGE_SIZE:
+                        #A short page before the last one means the listing was cut off, which must not cause deletions
+                        logger.warning(f"Catalog reconciliation aborted: page {page + i} of {page_count} has only {count} results")
+                        return
+                    if complete:
+                        break
+                page += window
+                window = RECONCILE_CONCURRENCY
+                if not complete:
+                    await asyncio.sleep(RECONCILE_PAGE_DELAY)
+        except ConnectionError as error:
+            logger.warning(f"Catalog reconciliation aborted after {pages} pages: {error}")
+            return
+
+        deleted = missing = 0
+        lastrow = 0
+        while lastrow is not None:
+            removed, marked, lastrow = await self.bot.db.run(self.delete_missing_mods, seen, cutoff, lastrow)
+            deleted += len(removed)
+            missing += marked
+            self.bot.mod_feed.publish([], removed)
+            await asyncio.sleep(0)
+        logger.info(f"Catalog reconciliation: {pages} pages, {inserted} inserted, {updated} updated, {deleted} deleted, "
+                    f"{missing} missing for the first time in {time.monotonic() - start:.0f}s")
+
+    @reconcile_catalog.before_loop
+    async def wait_before_reconcile(self):
+        await self.bot.catalog_ready.wait()
+
+    def load_reconcile_fixture(self) -> list:
+        if RECONCILE_FIXTURE is None:
+            return None
+        with open(RECONCILE_FIXTURE, "r") as f:
+            return self.bot.portal.parse_mods(json.load(f))
+
+    async def fetch_reconcile_page(self, page: int, fixture: list) -> tuple:
+        """
+        Returns the mods on a page of the full listing, the number of results on that page and the number of pages.
+        """
+        if fixture is not None:
+            mods = fixture[(page - 1) * RECONCILE_PAGE_SIZE:page * RECONCILE_PAGE_SIZE]
+            return mods, len(mods), -(-len(fixture) // RECONCILE_PAGE_SIZE)
+        url = f"{PORTAL_URL}/api/mods?page_size={RECONCILE_PAGE_SIZE}&page={page}&sort=created_at&sort_order=asc"
+        return await self.bot.portal.get_mods_page(url)
+
+    def reconcile_page(self, cur: sqlite3.Cursor, mods: list) -> tuple:
+        """
+        Inserts missing mods and updates changed ones from a page of the full listing. Runs on the database thread.
+
+        Rows whose stored release is newer than the listing, e.g. because the update checks stored it in the meantime,
+        are left alone. Returns the lists of inserted and updated mods.
+        """
+        existing = {}
+        for i in range(0, len(mods), MAX_QUERY_PARAMETERS):
+            names = [mod[0] for mod in mods[i:i + MAX_QUERY_PARAMETERS]]
+            rows = cur.execute(f"SELECT * FROM mods WHERE name IN ({', '.join('?' * len(names))})", names).fetchall()
+            existing.update((row[0], list(row)) for row in rows)
+        newmods = []
+        changedmods = []
+        for mod in mods:
+            stored = existing.get(mod[0])
+            if stored is None:
+                newmods.append(mod)
+            elif stored != mod and mod[1] >= stored[1]:
+                changedmods.append(mod)
+        cur.executemany("INSERT OR REPLACE INTO mods VALUES (?, ?, ?, ?, ?, ?)", newmods + changedmods)
+        return newmods, changedmods
+
+    def delete_missing_mods(self, cur: sqlite3.Cursor, seen: set, cutoff: str, lastrow: int) -> tuple:
+        """
+        Deletes mods that are no longer listed on the portal, one chunk of the table at a time. Runs on the database thread.
+        Mods released after the reconciliation started are kept, since the listing may not have included them.
+
+        The listing is paged without a snapshot, so a mod can be skipped when others are removed during the walk. Mods
+        missing for the first time are therefore only recorded in the missing_mods table, and deleted if they are still
+        missing in the next run. Mods that are listed again are cleared from that table.
+
+        Returns the deleted names, the number of mods missing for the first time and the rowid to continue from, or None
+        when the end of the table was reached.
+        """
+        if lastrow == 0:
+            cur.execute("DELETE FROM missing_mods WHERE name NOT IN (SELECT name FROM mods)")
+        previously = {name for name, in cur.execute("SELECT name FROM missing_mods").fetchall()}
+        rows = cur.execute("SELECT rowid, name, release_date FROM mods WHERE rowid > (?) ORDER BY rowid LIMIT (?)",
+                           [lastrow, RECONCILE_DELETE_CHUNK]).fetchall()
+        missing = {name for rowid, name, release_date in rows if name not in seen and release_date < cutoff}
+        removed = [name for name in missing if name in previously]
+        marked = [name for name in missing if name not in previously]
+        cur.executemany("DELETE FROM mods WHERE name = (?)", [(name,) for name in removed])
+        cur.executemany("DELETE FROM missing_mods WHERE name = (?)", [(name,) for rowid, name, release_date in rows if name in previously])
+        cur.executemany("INSERT OR IGNORE INTO missing_mods VALUES (?)", [(name,) for name in marked])
+        if len(rows) < RECONCILE_DELETE_CHUNK:
+            return removed, len(marked), None
+        return removed, len(marked), rows[-1][0]
+
     async def make_safe(self, string: str) -> str:
         """
         Escapes formatting to avoid unwanted behaviour in Discord messages.
@@ -139,22 +571,15 @@ class ModUpdates(commands.Cog):
 
         Returns either the URL or None if no thumbnail exists or the connection fails.
         """
-        url = f"https://mods.factorio.com/api/mods/{name}"
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(url) as response:
-                if response.ok == True:
-                    json = await response.json()
-                    if "thumbnail" in json:
-                        thumbnailraw = json["thumbnail"]
-                    else:
-                        return None
-                    if thumbnailraw != "/assets/.thumb.png":
-                        thumbnailURL = "https://assets-mod.factorio.com" + thumbnailraw
-                        return thumbnailURL
-                    else:
-                        return None
-                else:
-                    return None
+        json = await self.bot.portal.get_mod(name)
+        if json is None or "thumbnail" not in json:
+            return None
+        thumbnailraw = json["thumbnail"]
+        if thumbnailraw != "/assets/.thumb.png":
+            thumbnailURL = "https://assets-mod.factorio.com" + thumbnailraw
+            return thumbnailURL
+        else:
+            return None
 
     async def get_channels(self) -> list:
         """
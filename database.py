@@ -0,0 +1,249 @@
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from guildsettings import GuildSettings
+from metrics import metrics
+
+SHARED_VOLUME = "."
+DB_NAME = f"{SHARED_VOLUME}/mods.db"
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+]
+
+class Database:
+    '''
+    Async access to mods.db.
+
+    A single long-lived connection in WAL mode is owned by a dedicated thread, so queries never block the event loop and
+    are executed one at a time in the order they were submitted.
+    '''
+    def __init__(self, path: str = DB_NAME) -> None:
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self.con = None
+
+    async def connect(self) -> None:
+        await self._submit(self._connect)
+
+    async def close(self) -> None:
+        if self.con is not None:
+            await self._submit(self.con.close)
+            self.con = None
+        self.executor.shutdown(wait=False)
+
+    def _connect(self) -> None:
+        self.con = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            self.con.execute(pragma)
+
+    async def _submit(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _transaction(self, statement, func, *args):
+        start = time.perf_counter()
+        cur = self.con.cursor()
+        try:
+            result = func(cur, *args)
+            self.con.commit()
+            return result
+        except BaseException:
+            self.con.rollback()
+            metrics.inc("db_errors_total", statement=statement)
+            raise
+        finally:
+            metrics.observe("db_query_seconds", time.perf_counter() - start, statement=statement)
+
+    async def run(self, func, *args):
+        """
+        Runs func(cursor, *args) on the database thread inside a transaction, committing if it returns normally.
+        Its time is recorded under the function's name.
+        """
+        return await self._submit(self._transaction, func.__qualname__.replace(".<locals>", ""), func, *args)
+
+    async def _run_sql(self, sql: str, func):
+        return await self._submit(self._transaction, " ".join(sql.split()), func)
+
+    async def execute(self, sql: str, params=()) -> int:
+        """
+        Executes a single statement and commits it. Returns the number of changed rows.
+        """
+        return await self._run_sql(sql, lambda cur: cur.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, params) -> None:
+        await self._run_sql(sql, lambda cur: cur.executemany(sql, params))
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self._run_sql(sql, lambda cur: cur.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params=()):
+        return await self._run_sql(sql, lambda cur: cur.execute(sql, params).fetchone())
+
+    # Guilds
+
+    async def add_guild(self, guild_id: int) -> None:
+        await self.execute("INSERT OR IGNORE INTO guilds VALUES (?, ?, ?, ?)", (str(guild_id), None, None, None))
+
+    async def remove_guild(self, guild_id: int) -> None:
+        def remove(cur):
+            cur.execute("DELETE FROM guilds WHERE id = (?)", [str(guild_id)])
+            cur.execute("DELETE FROM subscriptions WHERE guild_id = (?)", [str(guild_id)])
+            cur.execute("DELETE FROM author_subscriptions WHERE guild_id = (?)", [str(guild_id)])
+        await self.run(remove)
+
+    async def guild_count(self) -> int:
+        return (await self.fetchone("SELECT count(*) FROM guilds"))[0]
+
+    async def set_modrole(self, guild_id: int, role_id: int) -> None:
+        await self.execute("UPDATE guilds SET modrole = (?) WHERE id = (?)", [str(role_id), str(guild_id)])
+
+    async def set_channel(self, guild_id: int, channel_id: int) -> None:
+        await self.execute("UPDATE guilds SET updates_channel = (?) WHERE id = (?)", [str(channel_id), str(guild_id)])
+
+    async def get_guild_settings(self, guild_id: int) -> GuildSettings:
+        """
+        Reads the updates channel, mod role, subscribed mods and subscribed authors of a guild in one go.
+        """
+        def read(cur):
+            row = cur.execute("SELECT updates_channel, modrole FROM guilds WHERE id = (?)", [str(guild_id)]).fetchone()
+            subscriptions = cur.execute("SELECT mod_name FROM subscriptions WHERE guild_id = (?)", [str(guild_id)]).fetchall()
+            authors = cur.execute("SELECT owner FROM author_subscriptions WHERE guild_id = (?)", [str(guild_id)]).fetchall()
+            updates_channel, modrole = row if row is not None else (None, None)
+            return GuildSettings(updates_channel, modrole, frozenset(name for name, in subscriptions), frozenset(owner for owner, in authors))
+        return await self.run(read)
+
+    # Subscriptions
+
+    async def add_subscription(self, guild_id: int, name: str) -> bool:
+        """
+        Returns whether the subscription was added, i.e. did not exist yet.
+        """
+        return await self.execute("INSERT OR IGNORE INTO subscriptions VALUES (?, ?)", [str(guild_id), name]) == 1
+
+    async def remove_subscription(self, guild_id: int, name: str) -> tuple:
+        """
+        Returns whether the subscription was removed, and whether the guild has any mod or author subscriptions left.
+        """
+        def remove(cur):
+            removed = cur.execute("DELETE FROM subscriptions WHERE guild_id = (?) AND mod_name = (?)", [str(guild_id), name]).rowcount == 1
+            return removed, self._has_subscriptions(cur, guild_id)
+        return await self.run(remove)
+
+    async def add_author_subscription(self, guild_id: int, owner: str) -> bool:
+        """
+        Returns whether the author subscription was added, i.e. did not exist yet.
+        """
+        return await self.execute("INSERT OR IGNORE INTO author_subscriptions VALUES (?, ?)", [str(guild_id), owner]) == 1
+
+    async def remove_author_subscription(self, guild_id: int, owner: str) -> tuple:
+        """
+        Returns whether the author subscription was removed, and whether the guild has any mod or author subscriptions left.
+        """
+        def remove(cur):
+            removed = cur.execute("DELETE FROM author_subscriptions WHERE guild_id = (?) AND owner = (?)", [str(guild_id), owner]).rowcount == 1
+            return removed, self._has_subscriptions(cur, guild_id)
+        return await self.run(remove)
+
+    @staticmethod
+    def _has_subscriptions(cur: sqlite3.Cursor, guild_id: int) -> bool:
+        return cur.execute('''SELECT EXISTS (SELECT 1 FROM subscriptions WHERE guild_id = (?))
+                           OR EXISTS (SELECT 1 FROM author_subscriptions WHERE guild_id = (?))''', [str(guild_id)] * 2).fetchone()[0] == 1
+
+    # Mods
+
+    async def get_mod_rows(self, after: int = 0) -> tuple:
+        """
+        Returns the mods stored after the given rowid, in mods table format, and the highest rowid seen.
+        Inserted and replaced rows get a new rowid, so this picks up every stored change except deletions.
+        """
+        def read(cur):
+            rows = cur.execute("SELECT rowid, * FROM mods WHERE rowid > (?) ORDER BY rowid", [after]).fetchall()
+            return [list(row[1:]) for row in rows], rows[-1][0] if rows else after
+        return await self.run(read)
+
+    async def get_mods(self) -> list:
+        """
+        Returns (name, title, owner, factorio_version) for every mod.
+        """
+        return await self.fetchall("SELECT name, title, owner, factorio_version FROM mods")
+
+    async def find_owner(self, owner: str) -> str:
+        """
+        Returns the owner name as stored in the mods table, matched case-insensitively, or None if no mod has that owner.
+        """
+        row = await self.fetchone("SELECT owner FROM mods WHERE owner = (?) COLLATE NOCASE LIMIT 1", [owner])
+        return row[0] if row is not None else None
+
+    async def search_owners(self, current: str, limit: int = 25) -> list:
+        """
+        Returns up to limit distinct mod owners starting with current, ignoring case.
+        """
+        prefix = current.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        rows = await self.fetchall("SELECT DISTINCT owner FROM mods WHERE owner LIKE (?) ESCAPE '\\' LIMIT (?)", [prefix + "%", limit])
+        return [owner for owner, in rows]
+
+    async def newest_release(self) -> str:
+        """
+        Returns the release date of the most recently released mod, or None if there are no mods.
+        """
+        return (await self.fetchone("SELECT max(release_date) FROM mods"))[0]
+
+    # Outbox
+
+    async def outbox_depth(self) -> int:
+        return (await self.fetchone("SELECT count(*) FROM outbox"))[0]
+
+    async def due_outbox(self, workers: int, index: int, now: float, limit: int, per_channel: int, shard_count: int = None, shard_ids: list = None) -> list:
+        """
+        Returns due outbox entries of the channels in a worker's partition, skipping channels that are backing off.
+        At most per_channel entries are taken per channel, the oldest first, so a batch spans many channels.
+        If shard IDs are given, only entries for guilds on those shards are returned. Entries without a guild are
+        only returned to the process running shard 0, so exactly one process handles them.
+        """
+        shard_filter = ""
+        params = [workers, index, now]
+        if shard_ids is not None:
+            unassigned = "guild_id IS NULL OR " if 0 in shard_ids else ""
+            shard_filter = f"AND ({unassigned}(guild_id >> 22) % (?) IN ({', '.join('?' * len(shard_ids))}))"
+            params += [shard_count, *shard_ids]
+        return await self.fetchall(f"""SELECT id, mod_name, version, channel_id, title, owner, tag, attempts FROM
+                                   (SELECT *, row_number() OVER (PARTITION BY channel_id ORDER BY release_date, id) AS position FROM outbox
+                                   WHERE channel_id % (?) = (?) AND next_attempt <= (?) {shard_filter}
+                                   AND channel_id NOT IN (SELECT channel_id FROM outbox WHERE next_attempt > (?)))
+                                   WHERE position <= (?) ORDER BY channel_id, release_date, id LIMIT (?)""",
+                                   params + [now, per_channel, limit])
+
+    async def finish_outbox(self, done: list, retry: list) -> None:
+        """
+        Removes delivered entries, given as (id,), and reschedules failed ones, given as (next_attempt, id).
+        """
+        def finish(cur):
+            cur.executemany("DELETE FROM outbox WHERE id = (?)", done)
+            cur.executemany("UPDATE outbox SET attempts = attempts + 1, next_attempt = (?) WHERE id = (?)", retry)
+        await self.run(finish)
+
+    # Multi-process coordination
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Takes or renews a named lease for `ttl` seconds, unless another owner holds it and has not let it expire.
+        Returns whether `owner` holds the lease.
+        """
+        now = time.time()
+        return await self.execute("""INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE
+                                  SET owner = excluded.owner, expires = excluded.expires
+                                  WHERE leases.owner = excluded.owner OR leases.expires < (?)""", [name, owner, now + ttl, now]) == 1
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        await self.execute("DELETE FROM leases WHERE name = (?) AND owner = (?)", [name, owner])
+
+    async def subscriptions_generation(self) -> int:
+        """
+        Returns a counter that is increased by every change to the guilds, subscriptions and author_subscriptions tables.
+        """
+        return (await self.fetchone("SELECT value FROM generations WHERE name = 'subscriptions'"))[0]
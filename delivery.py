@@ -0,0 +1,142 @@
+import os
+import time
+import asyncio
+import logging
+import discord
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    '''
+    Token bucket allowing `rate` operations per `per` seconds, with bursts up to `rate`.
+    '''
+    def __init__(self, rate: int, per: float) -> None:
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """
+        Waits until a token is available and takes it.
+
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.fill_rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class Delivery:
+    '''
+    Sends messages to many channels concurrently.
+
+    Messages for one channel are sent in order, one at a time. The number of sends in flight is bounded, and sends are
+    paced by a per-channel and a global token bucket matching Discord's rate limits.
+    '''
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.inflight = asyncio.Semaphore(int(os.getenv("DELIVERY_CONCURRENCY", 16)))
+        self.global_bucket = TokenBucket(self.global_rate(bot), 1)
+        self.channel_rate = int(os.getenv("DELIVERY_CHANNEL_RATE", 5))
+        self.channel_buckets = {}
+
+    def global_rate(self, bot) -> int:
+        """
+        Returns this process's share of the bot-wide DELIVERY_GLOBAL_RATE. Discord's global rate limit applies to the bot
+        as a whole, so a process running only some of the shards gets the same fraction of the rate.
+        """
+        rate = int(os.getenv("DELIVERY_GLOBAL_RATE", 40))
+        shard_ids = getattr(bot, "shard_ids", None)
+        shard_count = getattr(bot, "shard_count", None)
+        if shard_ids is not None and shard_count:
+            rate = max(1, rate * len(shard_ids) // shard_count)
+        return rate
+
+    async def deliver(self, messages: dict) -> dict:
+        """
+        Sends messages, given as a dict of channel ID to a list of keyword arguments for `channel.send`.
+        Messages rejected as invalid are skipped, or for multi-embed messages, retried one embed at a time.
+
+        Returns a dict of channel ID to the number of messages delivered to it, counted from the start of its list.
+        Channels that cannot be found map to None.
+        """
+        start = time.monotonic()
+        channel_ids = list(messages)
+        results = await asyncio.gather(*[self.deliver_channel(channel_id, messages[channel_id]) for channel_id in channel_ids])
+        logger.debug(f"Delivered {sum(result or 0 for result in results)} messages to {len(channel_ids)} channels in {time.monotonic() - start:.2f}s")
+        return dict(zip(channel_ids, results))
+
+    async def deliver_channel(self, channel_id: int, messages: list) -> int:
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            logger.info(f"Updates channel {channel_id} not found")
+            metrics.inc("delivery_failures_total", reason="missing_channel")
+            return None
+        bucket = self.channel_buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.channel_buckets[channel_id] = TokenBucket(self.channel_rate, 5)
+        delivered = 0
+        for message in messages:
+            metrics.observe("delivery_ratelimit_wait_seconds", await bucket.acquire(), bucket="channel")
+            metrics.observe("delivery_ratelimit_wait_seconds", await self.global_bucket.acquire(), bucket="global")
+            async with self.inflight:
+                start = time.monotonic()
+                try:
+                    await channel.send(**message)
+                except discord.HTTPException as error:
+                    if error.status != 400:
+                        logger.warning(f"Failed to send update to channel {channel_id}: {error}")
+                        metrics.inc("delivery_failures_total", reason="http")
+                        return delivered
+                    if len(message.get("embeds", [])) > 1:
+                        logger.info(f"Message to channel {channel_id} rejected, sending embeds one by one: {error}")
+                        metrics.inc("delivery_failures_total", reason="split")
+                        if not await self.send_individually(channel, bucket, message["embeds"]):
+                            return delivered
+                    else:
+                        logger.warning(f"Skipped invalid message to channel {channel_id}: {error}")
+                        metrics.inc("delivery_failures_total", reason="invalid")
+                except Exception as error:
+                    logger.warning(f"Failed to send update to channel {channel_id}: {error}")
+                    metrics.inc("delivery_failures_total", reason="error")
+                    return delivered
+                metrics.observe("delivery_send_seconds", time.monotonic() - start)
+                metrics.inc("delivery_messages_total")
+            delivered += 1
+        return delivered
+
+    async def send_individually(self, channel: discord.abc.Messageable, bucket: TokenBucket, embeds: list) -> bool:
+        """
+        Fallback for multi-embed messages that failed validation. Embeds that are invalid on their own are skipped.
+
+        Returns whether all remaining embeds were delivered.
+        """
+        for embed in embeds:
+            metrics.observe("delivery_ratelimit_wait_seconds", await bucket.acquire(), bucket="channel")
+            metrics.observe("delivery_ratelimit_wait_seconds", await self.global_bucket.acquire(), bucket="global")
+            try:
+                await channel.send(embed=embed)
+            except discord.HTTPException as error:
+                if error.status != 400:
+                    logger.warning(f"Failed to send update to channel {channel.id}: {error}")
+                    metrics.inc("delivery_failures_total", reason="http")
+                    return False
+                logger.warning(f"Skipped invalid embed for channel {channel.id}: {error}")
+                metrics.inc("delivery_failures_total", reason="invalid")
+            except Exception as error:
+                logger.warning(f"Failed to send update to channel {channel.id}: {error}")
+                metrics.inc("delivery_failures_total", reason="error")
+                return False
+        return True
@@ -0,0 +1,50 @@
+import asyncio
+from collections import namedtuple
+from metrics import metrics
+
+GuildSettings = namedtuple("GuildSettings", ["updates_channel", "modrole", "subscriptions", "authors"])
+
+class GuildSettingsCache:
+    '''
+    In-memory cache of per-guild settings: the updates channel, the mod role and the sets of subscribed mods and authors.
+
+    Guilds are loaded from the database on first use and kept until a write invalidates them. Concurrent lookups of
+    the same guild share a single load.
+    '''
+    def __init__(self, db) -> None:
+        self.db = db
+        self.entries = {}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        metrics.collect("cache_hits_total", lambda: self.hits, cache="guild_settings")
+        metrics.collect("cache_misses_total", lambda: self.misses, cache="guild_settings")
+
+    async def get(self, guild_id: int) -> GuildSettings:
+        settings = self.entries.get(guild_id)
+        if settings is not None:
+            self.hits += 1
+            return settings
+        self.misses += 1
+
+        future = self.inflight.get(guild_id)
+        if future is None:
+            future = asyncio.ensure_future(self.db.get_guild_settings(guild_id))
+            self.inflight[guild_id] = future
+            future.add_done_callback(lambda fut: self._store(guild_id, fut))
+        return await asyncio.shield(future)
+
+    def invalidate(self, guild_id: int) -> None:
+        """
+        Drops the cached settings of a guild, e.g. after its settings changed or the bot left it.
+        """
+        self.entries.pop(guild_id, None)
+        self.inflight.pop(guild_id, None)
+
+    def _store(self, guild_id: int, future: asyncio.Future) -> None:
+        if self.inflight.get(guild_id) is not future:
+            return
+        del self.inflight[guild_id]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.entries[guild_id] = future.result()
@@ -0,0 +1,72 @@
+import os
+import json
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+SHARED_VOLUME = "."
+SHARD_IDS = os.getenv("SHARD_IDS")
+#Processes running a subset of the shards share the volume, so each writes and rotates its own file by default
+DEFAULT_LOG_FILE = f"{SHARED_VOLUME}/botlog-shard{min(int(shard) for shard in SHARD_IDS.split(','))}.log" if SHARD_IDS else f"{SHARED_VOLUME}/botlog.log"
+LOG_FILE = os.getenv("LOG_FILE", DEFAULT_LOG_FILE)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "") #Per-module levels, e.g. "cogs.modupdates=DEBUG,discord=WARNING"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text") #"text" or "json"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 2**20))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN") #Rotate by time instead of size, e.g. "midnight"
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats records as one JSON object per line.
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class DeferredQueueHandler(QueueHandler):
+    '''
+    Queue handler that leaves all formatting, including tracebacks, to the listener thread.
+
+    The standard QueueHandler formats records before queueing them so they can be pickled; within one process that is
+    not needed and would keep the formatting work on the event loop.
+    '''
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging() -> QueueListener:
+    """
+    Routes all logging through a queue to a background thread that writes the log file, rotating it by size, or by
+    time if LOG_ROTATE_WHEN is set, and keeping LOG_BACKUP_COUNT old files.
+
+    Returns the started listener. It is stopped, flushing queued records, when the process exits.
+    """
+    if LOG_ROTATE_WHEN is not None:
+        handler = TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s:%(message)s"))
+
+    logqueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(DeferredQueueHandler(logqueue))
+    root.setLevel(LOG_LEVEL.upper())
+    for entry in LOG_LEVELS.split(","):
+        if "=" in entry:
+            name, level = entry.split("=", 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    listener = QueueListener(logqueue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,189 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from aiohttp import web
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+SHARD_IDS = os.getenv("SHARD_IDS")
+#Processes running a subset of the shards each serve metrics on their own port: 9108 plus their lowest shard ID
+DEFAULT_METRICS_PORT = 9108 + (min(int(shard) for shard in SHARD_IDS.split(",")) if SHARD_IDS else 0)
+METRICS_PORT = int(os.getenv("METRICS_PORT", DEFAULT_METRICS_PORT))
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+class Histogram:
+    '''
+    Cumulative histogram over fixed buckets, in the Prometheus layout.
+    '''
+    def __init__(self, buckets: tuple = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket containing the q-quantile, or None if nothing was observed.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    '''
+    Registry of counters, gauges and histograms, keyed by name and labels.
+
+    Metrics can be updated from any thread, e.g. the database thread. Values that are already tracked elsewhere, like
+    cache hit counts, are registered as collectors and read when the metrics are rendered.
+    '''
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.gauges[name, tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """
+        Observes the time spent in the block, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def collect(self, name: str, func, kind: str = "counter", **labels) -> None:
+        """
+        Registers a function returning the current value of a metric. Registering the same name and labels again
+        replaces the previous function, e.g. after a cog reload.
+        """
+        self.collectors[name, tuple(sorted(labels.items()))] = (kind, func)
+
+    def value(self, name: str, **labels) -> float:
+        """
+        Returns the current value of a counter or gauge, or 0 if it was never set.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        if key in self.collectors:
+            return self.collectors[key][1]()
+        return self.counters.get(key, self.gauges.get(key, 0))
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        return self.histograms.get((name, tuple(sorted(labels.items()))), Histogram())
+
+    def series(self, name: str) -> dict:
+        """
+        Returns the counters or histograms with the given name, as a dict of label dicts to values.
+        """
+        with self.lock:
+            found = [(labels, value) for (key, labels), value in list(self.counters.items()) + list(self.histograms.items()) if key == name]
+        return {labels: value for labels, value in found}
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            families = {}
+            for (name, labels), value in self.counters.items():
+                families.setdefault(name, ("counter", []))[1].append((labels, value))
+            for (name, labels), value in self.gauges.items():
+                families.setdefault(name, ("gauge", []))[1].append((labels, value))
+            histograms = [(name, labels, histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                          for (name, labels), histogram in self.histograms.items()]
+        for (name, labels), (kind, func) in list(self.collectors.items()):
+            try:
+                families.setdefault(name, (kind, []))[1].append((labels, func()))
+            except Exception as error:
+                logger.debug(f"{error} collecting metric {name}")
+
+        lines = []
+        for name, (kind, samples) in sorted(families.items()):
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        for name in sorted({histogram[0] for histogram in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for _, labels, buckets, counts, total, count in [histogram for histogram in histograms if histogram[0] == name]:
+                cumulative = 0
+                for bound, bucketcount in zip(buckets + ("+Inf",), counts):
+                    cumulative += bucketcount
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class MetricsServer:
+    '''
+    Serves the metrics at /metrics on a local port, for scraping by Prometheus.
+    '''
+    def __init__(self, registry: Metrics, host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+            logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        except OSError as error:
+            logger.warning(f"Could not start metrics endpoint on {self.host}:{self.port}: {error}")
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+metrics = Metrics()
@@ -1,16 +1,44 @@
 import sqlite3
 
+SHARED_VOLUME = "."
+DB_NAME = f"{SHARED_VOLUME}/mods.db"
+
 def upgradetov2():
+    """
+    Moves subscriptions from the comma-joined guilds.subscribedmods column into a dedicated subscriptions table.
+
+    The column itself is kept, since the guilds table is written with positional inserts, but it is cleared so no
+    stale copy of the subscriptions is left behind.
+    """
+    with sqlite3.connect(DB_NAME) as con:
+        cur = con.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS subscriptions (guild_id, mod_name, UNIQUE(guild_id, mod_name))")
+        cur.execute("CREATE INDEX IF NOT EXISTS subscriptions_mod_name ON subscriptions(mod_name)")
+        cur.execute(''' SELECT count(*) FROM sqlite_master WHERE type='table' AND name='guilds' ''')
+        if cur.fetchone()[0] == 1:
+            rows = cur.execute("SELECT id, subscribedmods FROM guilds WHERE subscribedmods IS NOT NULL").fetchall()
+            cur.executemany("INSERT OR IGNORE INTO subscriptions VALUES (?, ?)",
+                            [(guild_id, name) for guild_id, subscribedmods in rows for name in subscribedmods.split(", ") if name != ""])
+            cur.execute("UPDATE guilds SET subscribedmods = NULL")
+        con.commit()
     print("Upgraded to v2")
 
-migrations = {2: upgradetov2,}
+def upgradetov3():
+    """
+    Stores the guild of every outbox entry, so entries can be delivered by the process running the guild's shard.
+    """
+    with sqlite3.connect(DB_NAME) as con:
+        cur = con.cursor()
+        cur.execute(''' SELECT count(*) FROM sqlite_master WHERE type='table' AND name='outbox' ''')
+        if cur.fetchone()[0] == 1:
+            cur.execute("ALTER TABLE outbox ADD COLUMN guild_id INTEGER")
+            cur.execute("UPDATE outbox SET guild_id = (SELECT CAST(id AS INTEGER) FROM guilds WHERE updates_channel = CAST(outbox.channel_id AS TEXT))")
+        con.commit()
+    print("Upgraded to v3")
+
+migrations = {2: upgradetov2, 3: upgradetov3,}
 
 def migrate(old_version, current_version):
     for migration in migrations:
         if migration > old_version and migration <= current_version:
             migrations[migration]()
-
-
-# with sqlite3.connect("mods.db") as con:
-#     cur = con.cursor()
-
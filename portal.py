@@ -0,0 +1,205 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+import aiohttp
+from metrics import metrics
+from collections import OrderedDict
+
+PORTAL_URL = os.getenv("PORTAL_URL", "https://mods.factorio.com")
+
+class PortalClient:
+    '''
+    Long-lived HTTP client for all traffic to the Factorio mod portal.
+
+    One pooled session is shared by the whole bot so connections to mods.factorio.com are kept alive between requests.
+    Pool size and timeouts can be configured through the environment.
+    '''
+    def __init__(self) -> None:
+        self.limit_per_host = int(os.getenv("PORTAL_CONNECTIONS", 8))
+        self.keepalive_timeout = float(os.getenv("PORTAL_KEEPALIVE", 60))
+        self.dns_cache_ttl = int(os.getenv("PORTAL_DNS_TTL", 300))
+        self.timeout = aiohttp.ClientTimeout(total=float(os.getenv("PORTAL_TIMEOUT", 30)),
+                                             connect=float(os.getenv("PORTAL_CONNECT_TIMEOUT", 10)))
+        self.session = None
+        self.validators = {}
+        self.details = ModDetailsCache(int(os.getenv("PORTAL_CACHE_SIZE", 512)), float(os.getenv("PORTAL_CACHE_TTL", 600)))
+        metrics.collect("cache_hits_total", lambda: self.details.hits, cache="mod_details")
+        metrics.collect("cache_misses_total", lambda: self.details.misses, cache="mod_details")
+
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, keepalive_timeout=self.keepalive_timeout,
+                                         ttl_dns_cache=self.dns_cache_ttl, use_dns_cache=True)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_mods(self, url: str) -> list:
+        """
+        Grabs the list of all mods from the API page and filters out the relevant entries.
+        Returns a list of mods, each following the format [name, release date, title, owner, version, factorio_version]
+        """
+        try:
+            with metrics.time("portal_request_seconds", endpoint="mods"):
+                async with self.session.get(url) as response:
+                    if response.ok == True:
+                        json = await response.json()
+                        return self.parse_mods(json)
+                    else:
+                        metrics.inc("portal_errors_total", endpoint="mods")
+                        raise ConnectionError(f"Failed to retrieve mod list ({response.status})")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            metrics.inc("portal_errors_total", endpoint="mods")
+            raise ConnectionError(f"Failed to retrieve mod list ({error})")
+
+    async def get_mods_page(self, url: str) -> tuple:
+        """
+        Like get_mods, but also returns the number of results on the page, including mods without releases, and the
+        total number of pages in the listing, or None if the portal did not report it.
+
+        A page past the end of the listing is returned as an empty page.
+        """
+        try:
+            with metrics.time("portal_request_seconds", endpoint="mods"):
+                async with self.session.get(url) as response:
+                    if response.ok == True:
+                        json = await response.json()
+                        return self.parse_mods(json), len(json['results']), (json.get('pagination') or {}).get('page_count')
+                    elif response.status == 404:
+                        return [], 0, None
+                    else:
+                        metrics.inc("portal_errors_total", endpoint="mods")
+                        raise ConnectionError(f"Failed to retrieve mod list ({response.status})")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            metrics.inc("portal_errors_total", endpoint="mods")
+            raise ConnectionError(f"Failed to retrieve mod list ({error})")
+
+    async def get_mods_if_changed(self, url: str) -> list:
+        """
+        Like get_mods, but returns None when the page has not changed since the last call for the same URL.
+
+        Uses ETag/Last-Modified validators when the portal sends them, and otherwise compares a hash of the response
+        body, so an unchanged page is neither parsed nor diffed against the database.
+        """
+        headers = {}
+        validator = self.validators.get(url)
+        if validator is not None:
+            etag, last_modified, digest, mods = validator
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
+        try:
+            with metrics.time("portal_request_seconds", endpoint="mods"):
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return None
+                    if response.ok != True:
+                        metrics.inc("portal_errors_total", endpoint="mods")
+                        raise ConnectionError(f"Failed to retrieve mod list ({response.status})")
+                    body = await response.read()
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            metrics.inc("portal_errors_total", endpoint="mods")
+            raise ConnectionError(f"Failed to retrieve mod list ({error})")
+
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if validator is not None and validator[2] == digest:
+            return None
+        mods = self.parse_mods(json.loads(body))
+        self.validators[url] = (etag, last_modified, digest, mods)
+        if validator is not None and validator[3] == mods:
+            return None
+        return mods
+
+    def forget_validators(self) -> None:
+        """
+        Makes the next get_mods_if_changed call return the page even if it did not change, e.g. after a failed tick.
+        """
+        self.validators.clear()
+
+    def parse_mods(self, page: dict) -> list:
+        results = page['results']
+        mods = [[mod["name"], mod["latest_release"]["released_at"], mod["title"], mod["owner"], mod["latest_release"]["version"], mod["latest_release"]["info_json"]["factorio_version"]] for mod in results if mod.get('latest_release') is not None]
+        return mods
+
+    async def get_mod(self, name: str) -> dict:
+        """
+        Fetches the portal details of a single mod, served from the details cache when possible.
+
+        Returns the decoded JSON, or None if the request fails.
+        """
+        return await self.details.get(name, self._fetch_mod)
+
+    def invalidate(self, name: str) -> None:
+        """
+        Drops the cached details of a mod, e.g. after a new release.
+        """
+        self.details.invalidate(name)
+
+    async def _fetch_mod(self, name: str) -> dict:
+        url = f"{PORTAL_URL}/api/mods/{name}".replace(" ", "%20")
+        try:
+            with metrics.time("portal_request_seconds", endpoint="mod"):
+                async with self.session.get(url) as response:
+                    if response.ok == True:
+                        return await response.json()
+                    else:
+                        metrics.inc("portal_errors_total", endpoint="mod")
+                        return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            metrics.inc("portal_errors_total", endpoint="mod")
+            return None
+
+
+class ModDetailsCache:
+    '''
+    Bounded TTL/LRU cache for mod detail responses.
+
+    Concurrent lookups of the same mod share a single in-flight fetch. Failed fetches are not cached.
+    '''
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, name: str, fetch) -> dict:
+        entry = self.entries.get(name)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return value
+            del self.entries[name]
+        self.misses += 1
+
+        future = self.inflight.get(name)
+        if future is None:
+            future = asyncio.ensure_future(fetch(name))
+            self.inflight[name] = future
+            future.add_done_callback(lambda fut: self._store(name, fut))
+        return await asyncio.shield(future)
+
+    def invalidate(self, name: str) -> None:
+        self.entries.pop(name, None)
+        self.inflight.pop(name, None)
+
+    def _store(self, name: str, future: asyncio.Future) -> None:
+        if self.inflight.get(name) is not future:
+            return
+        del self.inflight[name]
+        if future.cancelled() or future.exception() is not None or future.result() is None:
+            return
+        self.entries[name] = (time.monotonic() + self.ttl, future.result())
+        self.entries.move_to_end(name)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
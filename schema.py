@@ -0,0 +1,82 @@
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def make_tables(cur: sqlite3.Cursor, guild_ids: set) -> int:
+    """
+    Creates or updates all tables. Runs on the database thread.
+
+    Returns the next catalog page to load if the mods table has not been filled completely yet, otherwise None.
+    """
+    #Check if guilds table exists, create if necessary
+    cur.execute(''' SELECT count(*) FROM sqlite_master WHERE type='table' AND name='guilds' ''')
+    if cur.fetchone()[0]!=1: #Guilds table does not yet exist
+        logger.warning(f"New guilds table created. This is expected on a first start")
+        #subscribedmods is unused since subscriptions moved to their own table, and always NULL
+        cur.execute('''CREATE TABLE guilds
+                    (id, updates_channel, modrole, subscribedmods, UNIQUE(id))''')
+
+    #Create subscriptions table if necessary
+    cur.execute("CREATE TABLE IF NOT EXISTS subscriptions (guild_id, mod_name, UNIQUE(guild_id, mod_name))")
+    cur.execute("CREATE INDEX IF NOT EXISTS subscriptions_mod_name ON subscriptions(mod_name)")
+    cur.execute("CREATE TABLE IF NOT EXISTS author_subscriptions (guild_id, owner, UNIQUE(guild_id, owner))")
+    cur.execute("CREATE INDEX IF NOT EXISTS author_subscriptions_owner ON author_subscriptions(owner)")
+
+    #Add guilds that were joined and remove guilds that were left while bot was offline
+    stored = {guild_id for guild_id, in cur.execute("SELECT id FROM guilds").fetchall()}
+    joined = guild_ids - stored
+    left = stored - guild_ids
+    cur.executemany("INSERT OR IGNORE INTO guilds VALUES (?, ?, ?, ?)", [(guild_id, None, None, None) for guild_id in joined])
+    if guild_ids == set() and stored != set():
+        logger.warning("No guilds fetched, not removing any stored guilds")
+        left = set()
+    else:
+        cur.executemany("DELETE FROM guilds WHERE id = (?)", [(guild_id,) for guild_id in left])
+        cur.executemany("DELETE FROM subscriptions WHERE guild_id = (?)", [(guild_id,) for guild_id in left])
+        cur.executemany("DELETE FROM author_subscriptions WHERE guild_id = (?)", [(guild_id,) for guild_id in left])
+    logger.info(f"Guilds on start: {len(guild_ids)}, added {len(joined)}, removed {len(left)}")
+    logger.debug(f"Added guilds on start: {joined}, removed guilds on start: {left}")
+
+    #Create outbox table if necessary
+    cur.execute('''CREATE TABLE IF NOT EXISTS outbox
+                (id INTEGER PRIMARY KEY AUTOINCREMENT, mod_name, version, channel_id INTEGER, release_date, title, owner, tag,
+                attempts DEFAULT 0, next_attempt DEFAULT 0, guild_id INTEGER, UNIQUE(mod_name, version, channel_id))''')
+    cur.execute("CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox(next_attempt)")
+
+    #Create table of mods missing from the last catalog reconciliation, deleted if still missing in the next one
+    cur.execute("CREATE TABLE IF NOT EXISTS missing_mods (name, UNIQUE(name))")
+
+    #Create leases table if necessary, holding the poller lease of multi-process setups
+    cur.execute("CREATE TABLE IF NOT EXISTS leases (name, owner, expires, UNIQUE(name))")
+
+    #Count changes to guilds and (author) subscriptions, so the poller notices changes made by other processes
+    cur.execute("CREATE TABLE IF NOT EXISTS generations (name, value, UNIQUE(name))")
+    cur.execute("INSERT OR IGNORE INTO generations VALUES ('subscriptions', 0)")
+    for table in ["guilds", "subscriptions", "author_subscriptions"]:
+        for change in ["INSERT", "UPDATE", "DELETE"]:
+            cur.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{change.lower()}_generation AFTER {change} ON {table}
+                        BEGIN UPDATE generations SET value = value + 1 WHERE name = 'subscriptions'; END''')
+
+    #Check if mods table exists, create if necessary
+    cur.execute(''' SELECT count(name) FROM sqlite_master WHERE type='table' AND name='mods' ''')
+    if cur.fetchone()[0]!=1: #Mods table does not yet exist - catalog is downloaded by bootstrap_catalog.
+        logger.warning("New mods table created. This is expected on a first start.")
+        cur.execute('''CREATE TABLE mods
+                (name, release_date, title, owner, version, factorio_version, UNIQUE(name))''')
+        cur.execute("CREATE TABLE IF NOT EXISTS bootstrap (next_page)")
+        cur.execute("INSERT INTO bootstrap VALUES (1)")
+    #Case-insensitive owner index, used by author autocomplete and author lookups
+    cur.execute("CREATE INDEX IF NOT EXISTS mods_owner ON mods(owner COLLATE NOCASE)")
+    return next_catalog_page(cur)
+
+
+def next_catalog_page(cur: sqlite3.Cursor) -> int:
+    """
+    Returns the next catalog page to load, or None if the catalog is complete.
+    """
+    cur.execute(''' SELECT count(name) FROM sqlite_master WHERE type='table' AND name='bootstrap' ''')
+    if cur.fetchone()[0]!=1:
+        return None
+    row = cur.execute("SELECT next_page FROM bootstrap").fetchone()
+    return row[0] if row is not None else None
@@ -0,0 +1,209 @@
+import re
+import sys
+from collections import Counter, OrderedDict
+from fuzzywuzzy import fuzz
+from metrics import metrics
+
+MAX_RESULTS = 25
+FUZZY_SHORTLIST = 100
+FUZZY_TOKEN_SIMILARITY = 0.4
+FUZZY_CACHE_SIZE = 256
+FUZZY_MATCH_RATIO = 90
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def trigrams(text: str) -> set:
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+def tokenize(text: str) -> set:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+class ModSearchIndex:
+    '''
+    Substring search over mod names, titles and owners, backed by a trigram index.
+
+    Queries of three characters or more only verify the mods that contain every trigram of the query. Shorter queries
+    scan the mods of the requested Factorio version in order and stop as soon as enough matches are found.
+
+    Typo-tolerant search goes through a separate word index: query words are matched against similar indexed words by
+    trigram overlap, and only the mods containing those words are scored with fuzzywuzzy.
+    '''
+    def __init__(self) -> None:
+        self.records = []
+        self.ids = {}
+        self.postings = {}
+        self.partitions = {}
+        self.tokens = {}
+        self.token_grams = {}
+        self.fuzzy_cache = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def sync(self, mods: list) -> None:
+        """
+        Brings the index in line with a full list of (name, title, owner, factorio_version) tuples.
+        Only mods that were added, changed or removed are touched.
+        """
+        seen = set()
+        for mod in mods:
+            seen.add(mod[0])
+            self.update(*mod)
+        for name in [name for name in self.ids if name not in seen]:
+            self.remove(name)
+
+    def update(self, name: str, title: str, owner: str, factorio_version: str) -> None:
+        """
+        Adds a mod to the index, or updates it if its details changed.
+        """
+        modid = self.ids.get(name)
+        if modid is not None:
+            if self.records[modid][0:4] == (name, title, owner, factorio_version):
+                return
+            self.remove(name)
+        modid = len(self.records)
+        keys = (name.lower(), title.lower(), sys.intern(owner.lower()))
+        self.records.append((name, title, owner, factorio_version, keys))
+        self.ids[name] = modid
+        for gram in trigrams(keys[0]) | trigrams(keys[1]) | trigrams(keys[2]):
+            self.postings.setdefault(gram, set()).add(modid)
+        self.partitions.setdefault(factorio_version, {})[modid] = None
+        for token in tokenize(name) | tokenize(title):
+            if token not in self.tokens:
+                self.tokens[token] = set()
+                for gram in trigrams(f" {token} "):
+                    self.token_grams.setdefault(gram, set()).add(token)
+            self.tokens[token].add(modid)
+        self.fuzzy_cache.clear()
+
+    def remove(self, name: str) -> None:
+        modid = self.ids.pop(name, None)
+        if modid is None:
+            return
+        name, title, owner, factorio_version, keys = self.records[modid]
+        self.records[modid] = None
+        for gram in trigrams(keys[0]) | trigrams(keys[1]) | trigrams(keys[2]):
+            posting = self.postings[gram]
+            posting.discard(modid)
+            if not posting:
+                del self.postings[gram]
+        del self.partitions[factorio_version][modid]
+        for token in tokenize(name) | tokenize(title):
+            mods = self.tokens[token]
+            mods.discard(modid)
+            if not mods:
+                del self.tokens[token]
+                for gram in trigrams(f" {token} "):
+                    tokens = self.token_grams[gram]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.token_grams[gram]
+        self.fuzzy_cache.clear()
+        if len(self.records) > 2 * len(self.ids) + 1000:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Rebuilds the index to drop the slots left behind by removed and updated mods.
+        """
+        records = [record for record in self.records if record is not None]
+        self.__init__()
+        for name, title, owner, factorio_version, keys in records:
+            self.update(name, title, owner, factorio_version)
+
+    def search(self, query: str, factorio_version: str = None, owners: bool = True, limit: int = MAX_RESULTS) -> list:
+        """
+        Finds mods whose name, title or (optionally) owner contains the query, case-insensitively.
+        When a Factorio version is given, only mods for that version are returned.
+
+        Returns up to `limit` tuples of (name, title, owner, factorio_version), in the order the mods were indexed.
+        """
+        query = query.lower()
+        if len(query) >= 3:
+            candidates = None
+            for gram in sorted(trigrams(query), key=lambda gram: len(self.postings.get(gram, ()))):
+                posting = self.postings.get(gram)
+                if not posting:
+                    return []
+                candidates = set(posting) if candidates is None else candidates & posting
+            candidates = sorted(candidates)
+        elif factorio_version is not None:
+            candidates = self.partitions.get(factorio_version, {})
+        else:
+            candidates = self.ids.values()
+
+        results = []
+        for modid in candidates:
+            name, title, owner, version, keys = self.records[modid]
+            if factorio_version is not None and version != factorio_version:
+                continue
+            if query in keys[0] or query in keys[1] or (owners and query in keys[2]):
+                results.append((name, title, owner, version))
+                if len(results) == limit:
+                    break
+        return results
+
+    def fuzzy(self, query: str, factorio_version: str = None, limit: int = MAX_RESULTS, cutoff: int = 60) -> list:
+        """
+        Finds the mods whose name or title best match the query, tolerating typos.
+        When a Factorio version is given, only mods for that version are returned.
+
+        Returns up to `limit` tuples of (score, (name, title, owner, factorio_version)), best match first.
+        """
+        key = (query.lower(), factorio_version, limit, cutoff)
+        if key in self.fuzzy_cache:
+            self.fuzzy_cache.move_to_end(key)
+            metrics.inc("cache_hits_total", cache="fuzzy_search")
+            return self.fuzzy_cache[key]
+        metrics.inc("cache_misses_total", cache="fuzzy_search")
+
+        candidates = Counter()
+        for querytoken in tokenize(query):
+            querygrams = trigrams(f" {querytoken} ")
+            overlap = Counter()
+            for gram in querygrams:
+                overlap.update(self.token_grams.get(gram, ()))
+            for token, shared in overlap.items():
+                similarity = 2 * shared / (len(querygrams) + len(token))
+                if token.startswith(querytoken):
+                    similarity = max(similarity, 0.5)
+                if similarity >= FUZZY_TOKEN_SIMILARITY:
+                    for modid in self.tokens[token]:
+                        candidates[modid] += similarity
+        if factorio_version is not None:
+            partition = self.partitions.get(factorio_version, {})
+            candidates = Counter({modid: weight for modid, weight in candidates.items() if modid in partition})
+
+        results = []
+        for modid, _ in candidates.most_common(FUZZY_SHORTLIST):
+            name, title, owner, version, keys = self.records[modid]
+            score = max(fuzz.WRatio(query, name), fuzz.WRatio(query, title))
+            if score >= cutoff:
+                closeness = max(fuzz.ratio(query.lower(), keys[0]), fuzz.ratio(query.lower(), keys[1]))
+                results.append((score, closeness, (name, title, owner, version)))
+        results.sort(key=lambda result: (-result[0], -result[1]))
+        results = [(score, mod) for score, closeness, mod in results[0:limit]]
+
+        self.fuzzy_cache[key] = results
+        while len(self.fuzzy_cache) > FUZZY_CACHE_SIZE:
+            self.fuzzy_cache.popitem(last=False)
+        return results
+
+    def best_match(self, query: str, mods: list) -> tuple:
+        """
+        Picks the mod a query clearly names, typos aside, from a list of (name, title, owner, factorio_version) results:
+        the one whose whole name or title is at least FUZZY_MATCH_RATIO similar to the query, if no other mod is as similar.
+
+        Returns None if there is no such mod, so partial matches like a single word are shown as suggestions instead.
+        """
+        query = query.lower()
+        scored = sorted(((max(fuzz.ratio(query, mod[0].lower()), fuzz.ratio(query, mod[1].lower())), mod) for mod in mods),
+                        key=lambda result: -result[0])
+        if scored == [] or scored[0][0] < FUZZY_MATCH_RATIO:
+            return None
+        if len(scored) > 1 and scored[1][0] == scored[0][0]:
+            return None
+        return scored[0][1]
@@ -0,0 +1,120 @@
+import sqlite3
+
+
+class SubscriptionIndex:
+    '''
+    In-memory inverted indexes from mod names and mod authors to the channels that should be notified of their updates.
+
+    Guilds without any mod or author subscriptions receive all updates and are kept in a separate channel set.
+    '''
+    def __init__(self) -> None:
+        self.guild_channels = {}
+        self.guild_mods = {}
+        self.guild_authors = {}
+        self.mod_channels = {}
+        self.owner_channels = {}
+        self.all_channels = set()
+        self.channel_guilds = {}
+
+    def build(self, cur: sqlite3.Cursor) -> None:
+        """
+        (Re)builds the index from the guilds, subscriptions and author_subscriptions tables.
+        """
+        self.guild_channels.clear()
+        self.guild_mods.clear()
+        self.guild_authors.clear()
+        self.mod_channels.clear()
+        self.owner_channels.clear()
+        self.all_channels.clear()
+        self.channel_guilds.clear()
+        for guild_id, channel_id in cur.execute("SELECT id, updates_channel FROM guilds").fetchall():
+            self.guild_channels[int(guild_id)] = int(channel_id) if channel_id is not None else None
+        for guild_id, name in cur.execute("SELECT guild_id, mod_name FROM subscriptions").fetchall():
+            self.guild_mods.setdefault(int(guild_id), set()).add(name)
+        for guild_id, owner in cur.execute("SELECT guild_id, owner FROM author_subscriptions").fetchall():
+            self.guild_authors.setdefault(int(guild_id), set()).add(owner)
+        for guild_id in self.guild_channels:
+            self._link(guild_id)
+
+    def channels_for(self, name: str, owner: str = None) -> set:
+        """
+        Returns the IDs of all channels that should receive an update for the specified mod by the specified author.
+        """
+        return self.all_channels | self.mod_channels.get(name, set()) | self.owner_channels.get(owner, set())
+
+    def set_channel(self, guild_id: int, channel_id: int) -> None:
+        self._unlink(guild_id)
+        self.guild_channels[guild_id] = channel_id
+        self.guild_mods.setdefault(guild_id, set())
+        self._link(guild_id)
+
+    def add_subscription(self, guild_id: int, name: str) -> None:
+        mods = self.guild_mods.setdefault(guild_id, set())
+        channel_id = self.guild_channels.get(guild_id)
+        mods.add(name)
+        if channel_id is not None:
+            self.all_channels.discard(channel_id)
+            self.mod_channels.setdefault(name, set()).add(channel_id)
+
+    def remove_subscription(self, guild_id: int, name: str) -> None:
+        mods = self.guild_mods.setdefault(guild_id, set())
+        channel_id = self.guild_channels.get(guild_id)
+        mods.discard(name)
+        if channel_id is not None:
+            channels = self.mod_channels.get(name)
+            if channels is not None:
+                channels.discard(channel_id)
+                if not channels:
+                    del self.mod_channels[name]
+            if not mods and not self.guild_authors.get(guild_id):
+                self.all_channels.add(channel_id)
+
+    def add_author_subscription(self, guild_id: int, owner: str) -> None:
+        self._unlink(guild_id)
+        self.guild_authors.setdefault(guild_id, set()).add(owner)
+        self._link(guild_id)
+
+    def remove_author_subscription(self, guild_id: int, owner: str) -> None:
+        self._unlink(guild_id)
+        self.guild_authors.setdefault(guild_id, set()).discard(owner)
+        self._link(guild_id)
+
+    def remove_guild(self, guild_id: int) -> None:
+        self._unlink(guild_id)
+        self.guild_channels.pop(guild_id, None)
+        self.guild_mods.pop(guild_id, None)
+        self.guild_authors.pop(guild_id, None)
+
+    def _link(self, guild_id: int) -> None:
+        channel_id = self.guild_channels.get(guild_id)
+        if channel_id is None:
+            return
+        self.channel_guilds[channel_id] = guild_id
+        mods = self.guild_mods.get(guild_id)
+        authors = self.guild_authors.get(guild_id)
+        if not mods and not authors:
+            self.all_channels.add(channel_id)
+            return
+        for name in mods or ():
+            self.mod_channels.setdefault(name, set()).add(channel_id)
+        for owner in authors or ():
+            self.owner_channels.setdefault(owner, set()).add(channel_id)
+
+    def _unlink(self, guild_id: int) -> None:
+        channel_id = self.guild_channels.get(guild_id)
+        if channel_id is None:
+            return
+        self.channel_guilds.pop(channel_id, None)
+        self.all_channels.discard(channel_id)
+        for name in self.guild_mods.get(guild_id, ()):
+            channels = self.mod_channels.get(name)
+            if channels is not None:
+                channels.discard(channel_id)
+                if not channels:
+                    del self.mod_channels[name]
+        for owner in self.guild_authors.get(guild_id, ()):
+            channels = self.owner_channels.get(owner)
+            if channels is not None:
+                channels.discard(channel_id)
+                if not channels:
+                    del self.owner_channels[owner]